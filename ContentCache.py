@@ -0,0 +1,116 @@
+import time
+from collections import OrderedDict, deque
+
+from loguru import logger
+
+import constants as c
+import metrics
+from SharedResources import SharedResources
+from User import User, INTEREST_BITS
+from enums import AgentFeature
+
+# content pack sections served by each agent feature
+FEATURE_SECTIONS = {
+    AgentFeature.EXPLORATION: ("openers", "poi"),
+    AgentFeature.GAME: ("quiz",),
+}
+
+
+class ContentCache:
+    """
+    LRU cache with per-entry TTL, bounded both by entry count and by approximate memory use.
+    """
+
+    def __init__(self, max_entries: int = c.CONTENT_CACHE_MAX_ENTRIES, max_bytes: int = c.CONTENT_CACHE_MAX_BYTES,
+                 ttl: float = c.CONTENT_CACHE_TTL, name: str = "content_cache"):
+        self.name = name  # prefix of the cache metrics
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.size = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            metrics.inc(f"{self.name}.miss")
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            metrics.inc(f"{self.name}.expired")
+            return None
+        self.entries.move_to_end(key)
+        metrics.inc(f"{self.name}.hit")
+        return value
+
+    def put(self, key, value, size: int):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            metrics.inc(f"{self.name}.evicted")
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def invalidate(self, predicate):
+        """Drops every entry whose key matches `predicate(key)`."""
+        for key in [key for key in self.entries if predicate(key)]:
+            self._remove(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+class ContentPrefetcher:
+    """
+    Warms per-user content (openers, quiz items, POI facts) from the local content pack as soon as a user
+    is detected, so the exploration and avatar features answer from cache.
+    """
+
+    def __init__(self, cache: ContentCache | None = None, shared: SharedResources | None = None):
+        self.cache = cache or ContentCache()
+        self.shared = shared or SharedResources()  # owner of the content pack, shared by the devices of a process
+
+    async def load_pack(self) -> dict:
+        return await self.shared.load_content_pack()
+
+    @staticmethod
+    def _suits(item: dict, user: User) -> bool:
+        if user.age is None:
+            return True
+        return item.get("min_age", 0) <= user.age <= item.get("max_age", 200)
+
+    async def prefetch(self, instance_id: int, user: User):
+        """Builds the content of every feature for the user of an instance."""
+        pack = await self.load_pack()
+        self.forget(instance_id)  # drop the content of a previous user of this seat
+        for feature, sections in FEATURE_SECTIONS.items():
+            items = []
+            for section in sections:
+                for interest, entries in pack.get(section, {}).items():
+                    bit = INTEREST_BITS.get(interest)
+                    if bit is None or not user.has_interest(bit):
+                        continue
+                    items.extend(item for item in entries if self._suits(item, user))
+            if items:
+                size = sum(len(item["text"]) for item in items)
+                self.cache.put((instance_id, feature), deque(items), size)
+        logger.info(f"Content prefetched for instance {instance_id}")
+
+    def next_item(self, instance_id: int, feature: AgentFeature) -> dict | None:
+        """Returns the next cached content item of a feature, rotating through the user's items."""
+        items = self.cache.get((instance_id, AgentFeature(feature)))
+        if not items:
+            return None
+        item = items[0]
+        items.rotate(-1)
+        return item
+
+    def forget(self, instance_id: int):
+        self.cache.invalidate(lambda key: key[0] == instance_id)
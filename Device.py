@@ -1,36 +1,97 @@
 import json
-import random
+import re
 import constants as c
 import asyncio
-import websockets
+from collections import deque
+from dataclasses import asdict
 import traceback
 from model import Model
-from enums import MessageName, LogLevel, DialogState, AgentFeature, EmailClass
+from enums import MessageName, LogLevel, DialogState, AgentFeature, EmailClass, SpeechPriority
 from helpers import classify_urgency
-from User import User
+from User import User, UserStore
 from loguru import logger
 
-from EmailManager import EmailManager
+from EmailManager import EmailManager, Email
+from EmailStore import EmailStore
+from TaskSupervisor import TaskSupervisor
+from ContentCache import ContentPrefetcher
+from ResponseCache import ResponseCache
+from SpeechScheduler import SpeechScheduler
+from SharedResources import SharedResources
+from StateSnapshot import StateSnapshot
+from Transport import Transport, WebSocketTransport
+import tracing
+
+# ECU frames reading or changing the mailbox, handled in order once the stored mailbox is loaded. Only AGENT_FEATURE
+# WORK reads the mailbox, the other features wait only to keep their order with a deferred WORK
+MAILBOX_MESSAGES = frozenset(name.value for name in (
+    MessageName.MAIL_START, MessageName.MAIL_END, MessageName.EMAIL_ADD, MessageName.EMAILS_ADD,
+    MessageName.NEXT_EMAIL, MessageName.AGENT_FEATURE, MessageName.RESET,
+))
+# frames changing the stored mailbox, spotted by the router of a sharded device without a full parse
+STORE_FRAME_PATTERN = re.compile(r'"name"\s*:\s*"(?:' + "|".join(name.value for name in (
+    MessageName.MAIL_START, MessageName.MAIL_END, MessageName.EMAIL_ADD, MessageName.EMAILS_ADD, MessageName.RESET,
+)) + ')"')
+TTS_COMPLETED_PATTERN = re.compile(r'"name"\s*:\s*"' + MessageName.TTS_COMPLETED.value + '"')
+# ECU field names of the Email fields, in order
+EMAIL_FIELDS = ("sender_name", "object", "content", "kind", "sender_email_address", "date", "time")
 
 
 class Device:
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, email_store_path: str | None = c.EMAIL_STORE_PATH, shards: int = 0,
+                 snapshot_path: str | None = None, shared: SharedResources | None = None, name: str = "device"):
         self.url = url
-        self.ws: websockets.WebSocketClientProtocol | None = None
-        self.em = EmailManager()
+        self.name = name  # tells the devices of a multi-ECU process apart in logs and metrics
+        # read-only / content-addressed resources, shared with the other devices of the process
+        self.shared = shared or SharedResources()
+        # optional router running the Model instances in `shards` worker processes
+        self.router = None
+        if shards:
+            from ShardRouter import ShardRouter  # multiprocessing is only needed by sharded devices
+            self.router = ShardRouter(shards)
+        # optional warm-restart snapshot of the runtime state, the Model instances of a sharded device live in
+        # the workers and are not snapshotted
+        self.snapshot = StateSnapshot(snapshot_path) if snapshot_path and not self.router else None
+        self.ws: Transport | None = None  # connection to the ECU
+        # the stored mailbox loads off the event loop once the device starts, so that startup does not depend on
+        # the mailbox size, the mailbox frames wait for it on `mailbox_ready`. A sharded device is the only writer
+        # of the store, its workers keep in-memory mailboxes
+        self.em = EmailManager(store=EmailStore(email_store_path) if email_store_path else None,
+                               warm_start=False, summaries=self.shared.summaries)
+        self.mailbox_ready = asyncio.Event()
+        self.mailbox_loading = False
+        self.deferred_frames = deque()  # (raw frame, parsed frame) of the mailbox frames waiting for the mailbox
+        if self.em.store is None:
+            self.mailbox_ready.set()
         self.models = {}  # dict to hold Model instances keyed by instance_id: {1: Model(), ...}
-        self.user_map = {}  # dict to hold instance_id to user mapping: {1: User(), ...}
+        self.users = UserStore()  # typed user profiles keyed by instance_id: {1: User(), ...}
+        self.content = ContentPrefetcher(shared=self.shared)  # per-user exploration / avatar content
+        self.responses = ResponseCache()  # generated responses shared by every zone
+        # cabin-wide TTS arbitration across zones, a sharded device arbitrates the speech of all its workers
+        self.speech = SpeechScheduler(self._write_frame, self.send_tts_interrupt, on_released=self.on_speech_released,
+                                      name=f"{name}.speech")
         self.instance2zone = {}  # dict to hold instance_id to zone_id mapping: {1: "mappo_ai_front_left_zone", ...}
         self.zone2card = {}  # dict to hold zone_id to card_id mapping: {"mappo_ai_front_left_zone": "mappo-front-left", ...}
         self.card2instance = {}  # dict to hold card_id to instance mapping: {"mappo-front-left": 1, ...}
         self.instance2card = {}  # dict to hold instance to card_id mapping: {1: "mappo-front-left", ...}
         self.agent_feature = None
+        self.restored_workflow = None  # snapshot workflow position, re-applied once the ECU connects
+        self.tasks = TaskSupervisor(name)
+        self.work_frames = {}  # pre-serialized opening TTS frame of the email workflow keyed by instance_id
+        self.work_frames_version = None  # EmailManager version the work frames were built for
 
     def is_connected(self):
-        return self.ws and not self.ws.closed
+        return self.ws is not None and not self.ws.closed
 
     async def start(self):
+        if self.router:
+            await self.router.start(self.send_frame, self.speech)
+        if self.snapshot:
+            await self.restore_snapshot()
+            self.tasks.spawn(self._snapshot_loop(), "snapshot", scope="snapshot")
+        else:
+            self.load_mailbox()
         await asyncio.gather(
             self.connect_ws(),
             # self.log_states()
@@ -40,38 +101,231 @@ class Device:
         for instance_id in self.models:
             logger.info(f"Interrupting instance {instance_id}")
             await self.interrupt(instance_id)
-        self.user_map = {}
+        self.users.clear()
+        self.content.cache.clear()
+        self.speech.clear()
         await self.send_agent_feature(AgentFeature.DIALOG, -1)
 
     async def connect_ws(self):
+        import websockets  # deferred, not needed until the first connection and never by in-process transports
         try:
             async with websockets.connect(self.url) as ws:
-                self.ws = ws
-                await self.on_open()
-                await self.listen_ws(ws)
+                await self.serve(WebSocketTransport(ws))
         except Exception as e:
-            logger.error(f"Failed to connect to local WebSocket: {e}")
+            logger.error(f"Failed to connect to local WebSocket {self.url}: {e}")
             await self.on_close()
 
-    async def listen_ws(self, ws: websockets.WebSocketClientProtocol):
+    async def serve(self, transport: Transport):
+        """Runs the ECU session over an established transport until the peer closes it."""
+        self.ws = transport
+        await self.on_open()
+        if self.restored_workflow:
+            # on_open switches the ECU to DIALOG, the restored feature and step are applied on top of it
+            self.tasks.spawn(self._resume_workflow(), "resume_workflow", scope="email")
+        await self.listen_ws(transport)
+
+    async def listen_ws(self, ws: Transport):
+        handle = self._route if self.router else self.handle_ecu_message
         async for message in ws:
-            await self.handle_ecu_message(message)
+            await handle(message)
+
+    async def _route(self, message_data: str):
+        """Forwards an ECU frame to the shard workers, persisting the mailbox frames on the way."""
+        if self.em.store and STORE_FRAME_PATTERN.search(message_data):
+            if not self.mailbox_ready.is_set():
+                self.load_mailbox()
+                await self.mailbox_ready.wait()
+            await self._store_mailbox_frame(await self._parse_frame(message_data))
+        elif TTS_COMPLETED_PATTERN.search(message_data):
+            await self.speech.completed(self.router.instance_of(message_data))
+        await self.router.route(message_data)
+
+    async def _store_mailbox_frame(self, message: dict):
+        # ingestion only, the workers classify and read out their own copy of the mailbox
+        name = message.get("name")
+        if name == MessageName.MAIL_START:
+            self.em.begin_sync()
+        elif name == MessageName.MAIL_END:
+            self.em.end_sync()
+        elif name == MessageName.EMAIL_ADD:
+            self.em.add_email(*self._email_from_fields(self._fields_to_dict(message.get("fields"))))
+        elif name == MessageName.EMAILS_ADD:
+            await self._add_emails(message.get("emails", []))
+        elif name == MessageName.RESET:
+            await self.em.reset()
+
+    async def _replay_mailbox(self):
+        """Sends the stored mailbox to the shard workers, as the ECU would."""
+        emails = [[{"name": name, "value": value} for name, value in zip(EMAIL_FIELDS, email)]
+                  for email in self.em.original_emails]
+        await self.router.route(json.dumps({"name": MessageName.EMAILS_ADD.value, "type": "method_struct_array",
+                                            "instance": -1, "emails": emails}))
+        await self.router.route(json.dumps({"name": MessageName.MAIL_END.value, "type": "method_void",
+                                            "instance": -1}))
+
+    def capture_state(self) -> dict:
+        """Captures the runtime state as snapshot sections: the device-wide state and one section per instance."""
+        sections = {
+            "device": {
+                "agent_feature": self.agent_feature,
+                "zone2card": dict(self.zone2card),  # serialized in a worker thread, don't share live dicts
+                "email_step": self.em.step,
+                "next_email": self.em.next_email,
+                "report_msgs": list(self.em.report_msgs),
+            },
+        }
+        for instance_id, model in self.models.items():
+            user = self.users.get(instance_id)
+            sections[f"instance:{instance_id}"] = {
+                "instance_id": instance_id,
+                "zone": self.instance2zone.get(instance_id),
+                "card": self.instance2card.get(instance_id),
+                "user": asdict(user) if user else None,
+                "context": list(model.context),
+            }
+        return sections
+
+    def restore_state(self, sections: dict):
+        """Rebuilds the Model instances, maps, user profiles and workflow position from snapshot sections."""
+        device = sections.get("device")
+        if device:
+            self.restored_workflow = device
+            self.zone2card = device["zone2card"]
+        for key, instance in sections.items():
+            if not key.startswith("instance:"):
+                continue
+            instance_id = instance["instance_id"]
+            model = self.models.get(instance_id)
+            if model is None:
+                model = self.models[instance_id] = Model(instance_id=instance_id, device_name=self.name)
+            model.context = instance["context"]
+            self.instance2zone[instance_id] = instance["zone"]
+            self.instance2card[instance_id] = instance["card"]
+            self.card2instance[instance["card"]] = instance_id
+            if instance["user"] is not None:
+                self.users.put(instance_id, User(**instance["user"]))
+                self.tasks.spawn(self.content.prefetch(instance_id, self.users.get(instance_id)),
+                                 f"prefetch_content_{instance_id}", scope="prefetch")
+
+    async def restore_snapshot(self):
+        """Restores the state of the previous run, the models get their device once the ECU connects."""
+        sections = await asyncio.get_running_loop().run_in_executor(None, self.snapshot.load)
+        if sections:
+            self.restore_state(sections)
+            logger.info(f"Restored {len(self.models)} instances from the state snapshot")
+        self.load_mailbox()
+
+    def load_mailbox(self):
+        """Loads the stored mailbox in the background."""
+        if self.mailbox_ready.is_set() or self.mailbox_loading:
+            return
+        self.mailbox_loading = True
+        self.tasks.spawn(self._load_mailbox(), "load_mailbox", scope="email")
+
+    async def _load_mailbox(self):
+        try:
+            if self.router:
+                await asyncio.get_running_loop().run_in_executor(None, self.em.warm_start, False)
+                if self.em.original_emails:
+                    await self._replay_mailbox()
+                return
+            await asyncio.get_running_loop().run_in_executor(None, self.em.warm_start)
+            self.precompute_work_frames()
+        finally:
+            self.mailbox_ready.set()
+
+    async def _resume_workflow(self):
+        """Re-applies the restored agent feature and email workflow position once the mailbox is loaded."""
+        await self.mailbox_ready.wait()
+        device, self.restored_workflow = self.restored_workflow, None
+        if device is None:
+            return
+        # the workflow position is only meaningful for the mailbox restored from the email store
+        if self.em.original_emails:
+            self.em.step = device["email_step"]
+            self.em.next_email = device["next_email"]
+            self.em.report_msgs = deque(device["report_msgs"])
+        if device["agent_feature"]:
+            await self.send_agent_feature(AgentFeature(device["agent_feature"]), -1)
+        logger.info(f"Resumed the {device['agent_feature']} feature at email workflow step {self.em.step}")
+
+    async def save_snapshot(self) -> int:
+        """Writes the state sections that changed, serialization and I/O run in a worker thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.snapshot.write, self.capture_state())
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(c.SNAPSHOT_INTERVAL)
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                logger.error(f"Failed to write the state snapshot: {e}")
+
+    @staticmethod
+    def _fields_to_dict(fields: list[dict]) -> dict:
+        return {field["name"]: field["value"] for field in fields}
+
+    @staticmethod
+    def _email_from_fields(fields: dict) -> Email:
+        return Email(*(fields.get(name) for name in EMAIL_FIELDS))
+
+    @staticmethod
+    async def _parse_frame(message_data: str) -> dict:
+        # a whole mailbox in one frame takes tens of milliseconds to parse, keep it off the event loop
+        clean_message = message_data.rstrip('\n\x00')
+        if len(clean_message) < c.LARGE_FRAME_BYTES:
+            return json.loads(clean_message)
+        return await asyncio.get_running_loop().run_in_executor(None, json.loads, clean_message)
+
+    async def _add_emails(self, emails: list[list[dict]]):
+        """Ingests a batched mailbox frame by chunks, so that a large mailbox does not stall the other zones."""
+        for start in range(0, len(emails), c.EMAIL_INGEST_CHUNK):
+            if start:
+                await asyncio.sleep(0)
+            self.em.add_emails([self._email_from_fields(self._fields_to_dict(fields))
+                                for fields in emails[start:start + c.EMAIL_INGEST_CHUNK]])
 
     async def handle_ecu_message(self, message_data):
-        logger.info(f"Received message: {message_data}")
         try:
-            clean_message = message_data.rstrip('\n\x00')
-            message = json.loads(clean_message)
+            message = await self._parse_frame(message_data)
         except Exception as e:
             logger.error(f"Failed to parse message: {e} - {traceback.format_exc()}")
             return
 
+        name = message.get("name")
+        if name in MAILBOX_MESSAGES and (self.deferred_frames or not self.mailbox_ready.is_set() and (
+                name != MessageName.AGENT_FEATURE or message.get("value") == AgentFeature.WORK)):
+            # the other frames (TTS_COMPLETED, USER_SPEECH...) keep flowing while the mailbox loads
+            self.load_mailbox()
+            self.deferred_frames.append((message_data, message))
+            if len(self.deferred_frames) == 1:
+                self.tasks.spawn(self._handle_deferred_frames(), "deferred_mailbox_frames", scope="email")
+            return
+        await self._handle_message(message_data, message)
+
+    async def _handle_deferred_frames(self):
+        await self.mailbox_ready.wait()
+        # a frame leaves the queue once handled, the mailbox frames arriving meanwhile queue up behind it
+        while self.deferred_frames:
+            try:
+                await self._handle_message(*self.deferred_frames[0])
+            finally:
+                self.deferred_frames.popleft()
+            await asyncio.sleep(0)  # a backlog of email frames must not stall the other zones
+
+    async def _handle_message(self, message_data: str, message: dict):
         instance_id = message.get("instance")
+        name = message.get("name")
+        # email frames can be large and frequent, keep their payload out of the INFO log
+        if name in (MessageName.EMAIL_ADD, MessageName.EMAILS_ADD):
+            logger.debug(f"Received message: {name}")
+        else:
+            logger.info(f"Received message: {message_data}")
 
         if message.get("type") == MessageName.INSTANCE_ADD:
             # Create a new Model instance if it doesn't exist already
             if instance_id not in self.models:
-                self.models[instance_id] = Model(instance_id=instance_id)
+                self.models[instance_id] = Model(instance_id=instance_id, device_name=self.name)
 
                 zone_id = message.get("value")
                 self.instance2zone[instance_id] = zone_id
@@ -89,52 +343,47 @@ class Device:
                 await self.interrupt(instance_id)
                 if value == "true":
                     await asyncio.sleep(0.2)
-                    asyncio.create_task(self.models[instance_id].chat())
+                    self.models[instance_id].start_chat()
 
         if message.get("name") == MessageName.USER_DETECTED:
-            user = User()
-            fields = message.get("fields")
-            message = {}
-            for field in fields:
-                message[field["name"]] = field["value"]
-
-            for field_name in message:
-                setattr(user, field_name, message[field_name])
-
-            self.user_map[instance_id] = user.__dict__
-            logger.info(f"New user detected. User map: {json.dumps(self.user_map, indent=2)}")
+            diff = self.users.update(instance_id, self._fields_to_dict(message.get("fields")))
+            if diff:
+                logger.info(f"User detected on instance {instance_id}: {diff}")
+                self.tasks.spawn(self.content.prefetch(instance_id, self.users.get(instance_id)),
+                                 f"prefetch_content_{instance_id}", scope="prefetch")
 
         if message.get("name") == MessageName.MAIL_START:
-            pass
+            # the ECU sends its whole mailbox, the stored emails it does not send again are dropped at MAIL_END
+            self.em.begin_sync()
 
         if message.get("name") == MessageName.MAIL_END:
+            self.em.end_sync()
             self.em.step = 0
-            asyncio.create_task(self.em.process_emails(),
-                                name=f"email_task_{instance_id}_{random.randint(1, 1000)}")
+            self.tasks.spawn(self.process_emails(), f"process_emails_{instance_id}", scope="email")
 
         if message.get("name") == MessageName.EMAIL_ADD:
-            fields = message.get("fields")
-            message = {}
-            for field in fields:
-                message[field["name"]] = field["value"]
+            email = self._email_from_fields(self._fields_to_dict(message.get("fields")))
+            self.em.add_email(*email)
 
-            logger.info(message)
+        if message.get("name") == MessageName.EMAILS_ADD:
+            # batched variant of EMAIL_ADD: {"emails": [[{"name": ..., "value": ...}, ...], ...]}
+            await self._add_emails(message.get("emails", []))
 
-            sender_name = message.get("sender_name")
-            subject = message.get("object")
-            content = message.get("content")
-            kind = message.get("kind")
-            self.em.add_email(sender_name, subject, content, kind)
+        if message.get("name") == MessageName.USER_SPEECH:
+            if instance_id in self.models:
+                await self.models[instance_id].barge_in()
 
         if message.get("name") == MessageName.NEXT_EMAIL:
             self.em.next_email = True
 
         if message.get("name") == MessageName.TTS_COMPLETED:
+            tracing.event("tts_completed", instance_id, turn=tracing.last_turn(instance_id, self.name))
             self.models[instance_id].tts_completed = True
+            await self.speech.completed(instance_id)
             if self.em.step == 2 and self.agent_feature == AgentFeature.WORK:
                 await self.models[instance_id].disable_chat(idle=False)
                 await asyncio.sleep(0.2)
-                asyncio.create_task(self.models[instance_id].chat())
+                self.models[instance_id].start_chat()
 
         if message.get("name") == MessageName.AGENT_FEATURE:
             value = message.get("value")
@@ -144,7 +393,10 @@ class Device:
                 if self.em.step != -1:
                     self.em.step = 0
 
-            if value == AgentFeature.WORK:
+            # the feature is cabin-wide, a shard worker without the instance only follows it
+            if value == AgentFeature.WORK and instance_id in self.models:
+                # a mailbox sync may still be classifying, start from the emails the ECU just sent
+                await self.tasks.join(scope="email")
                 # execute email workflow
                 if self.em.step == 0:
                     await self.exec_work_flow(instance_id, 0)
@@ -154,6 +406,7 @@ class Device:
 
         if message.get("name") == MessageName.RESET:
             await self._reset()
+            await self.em.reset()  # unlike a reconnect, a reset also forgets the stored mailbox
 
     async def on_open(self):
         await self.send_log_message("Connection Opened", LogLevel.INFO)
@@ -163,10 +416,11 @@ class Device:
 
     async def on_close(self):
         await self._reset()
-        await self.em.reset()
+        # keep the ingested emails and summaries, a reconnect only rewinds the workflow
+        await self.em.reset_workflow()
         await self.send_log_message("Connection Closed", LogLevel.WARNING)
 
-    async def on_error(self, ws: websockets.WebSocketClientProtocol | None, error: Exception):
+    async def on_error(self, ws: Transport | None, error: Exception):
         await self.send_log_message(f"WS Error: {error}", LogLevel.ERROR)
         if ws:
             await self.on_close()
@@ -174,9 +428,42 @@ class Device:
         await self.connect_ws()
 
     async def interrupt(self, instance_id: int):
+        await self.speech.cancel(instance_id)
         await self.models[instance_id].disable_chat()
 
+    def on_speech_released(self, instance_id: int):
+        # an utterance was preempted or timed out, don't leave the model waiting for its TTS_COMPLETED
+        if self.router:
+            self.router.released(instance_id)
+        elif instance_id in self.models:
+            self.models[instance_id].tts_completed = True
+
+    async def process_emails(self):
+        await self.em.process_emails()
+        self.precompute_work_frames()
+
+    def precompute_work_frames(self):
+        """Serializes the opening turn of the email workflow for every instance ahead of the WORK feature."""
+        for instance_id in self.models:
+            self._get_work_frame(instance_id)
+
+    def _get_work_frame(self, instance_id: int) -> str | None:
+        if self.work_frames_version != self.em.version:
+            self.work_frames = {}
+            self.work_frames_version = self.em.version
+        frame = self.work_frames.get(instance_id)
+        if frame is None:
+            text = self.em.work_entry_message()
+            if text is None:
+                return None
+            frame = self.work_frames[instance_id] = self._serialize(self._tts_message(text, instance_id))
+        return frame
+
     async def exec_work_flow(self, instance_id: int, step: int, user_input: str = None):
+        with tracing.span("exec_work_flow", instance_id, step=step):
+            return await self._exec_work_flow(instance_id, step, user_input)
+
+    async def _exec_work_flow(self, instance_id: int, step: int, user_input: str = None):
         async def finish_work_flow():
             logger.info("Finishing email workflow.")
             self.em.step = 0
@@ -199,22 +486,24 @@ class Device:
             else:
                 # If both types of emails are present, prepare and send the resume message
                 message = await self.em.compose_resume_message()
-                await self.send_text(message, instance_id)
+                work_frame = self._get_work_frame(instance_id)
+                if work_frame:
+                    await self.send_text_frame(work_frame, instance_id, length=len(message))
+                else:
+                    await self.send_text(message, instance_id)
                 self.em.step += 1  # Proceed to Step 1
 
                 # Start chat if not already enabled
                 if not self.models[instance_id].chat_enabled:
-                    asyncio.create_task(self.models[instance_id].chat(instant=False),
-                                        name=f"chat_task_{instance_id}_{random.randint(1, 1000)}")
+                    self.models[instance_id].start_chat(instant=False)
                 return  # exit after setting up the prompt
 
         if step == 1:  # Step 1: User Input Processing
             assert user_input is not None, "User input must not be None"
             urgency = classify_urgency(user_input)
             success = await self.em.generate_report(urgency)
-            message = self.em.report_msgs[0]
-            await self.send_text(message, instance_id)
-            self.em.report_msgs.pop(0)
+            message = self.em.report_msgs.popleft()
+            await self.send_text(message, instance_id, self._report_priority(message))
             if success:
                 self.em.step += 1
             return  # Exit after processing the user input
@@ -222,12 +511,12 @@ class Device:
         # Step 2: Email Reading
         if step == 2:
             if self.em.report_msgs:
-                message = self.em.report_msgs[0]
+                message = self.em.report_msgs.popleft()
+                priority = self._report_priority(message)
                 if self.em.next_email and not message.lower().startswith("urgent") and not message.lower().startswith(
                         "less"):
                     message = "Next email: " + message
-                await self.send_text(message, instance_id)
-                self.em.report_msgs.pop(0)
+                await self.send_text(message, instance_id, priority)
                 self.em.next_email = False
                 if len(self.em.report_msgs) == 0:
                     await finish_work_flow()
@@ -235,21 +524,39 @@ class Device:
 
         return message
 
+    def _report_priority(self, message: str) -> SpeechPriority:
+        return SpeechPriority.URGENT_EMAIL if self.em.is_urgent(message) else SpeechPriority.DIALOG
+
+    @staticmethod
+    def _serialize(message: dict) -> str:
+        return json.dumps(message) + '\0'
+
     async def send_message(self, message: dict):
+        await self.send_frame(self._serialize(message))
+
+    async def send_frame(self, frame: str):
+        """Sends an already serialized message, tagged with the current turn id when tracing."""
+        await self._write_frame(tracing.tag_frame(frame))
+
+    async def _write_frame(self, frame: str):
         if not self.is_connected():
             logger.error("Cannot send message: WebSocket is not connected.")
             return
-        logger.info(f"Sending message: {message}")
-        await self.ws.send(json.dumps(message) + '\0')
+        logger.info(f"Sending message: {frame.rstrip(chr(0))}")
+        with tracing.span("send_message"):
+            await self.ws.send(frame)
 
     async def send_dialog_state(self, state: DialogState, instance_id: int | None):
+        await self.send_frame(self.dialog_state_frame(state, instance_id))
+
+    def dialog_state_frame(self, state: DialogState, instance_id: int | None) -> str:
         message = {
             "name": MessageName.DIALOG_STATE.value,
             "type": "object_simple_signal",
             "instance": instance_id,
             "value": state.value if isinstance(state, DialogState) else state,
         }
-        await self.send_message(message)
+        return self._serialize(message)
 
     async def send_log_message(self, text: str, level: LogLevel, instance_id: int = -1):
         message = {
@@ -282,15 +589,25 @@ class Device:
         }
         await self.send_message(message)
 
-    async def send_text(self, text: str, instance_id: int):
+    async def send_text(self, text: str, instance_id: int, priority: SpeechPriority = SpeechPriority.DIALOG):
         if not text:
             text = "Sorry, I couldn't understand that. Please try again."
             logger.warning("Text to be synthesized was empty, sending default message.")
             # return
 
-        message_name = MessageName.TTS_TEXT.value
-        message = {
-            "name": message_name,
+        frame = self._serialize(self._tts_message(text, instance_id))
+        await self.send_text_frame(frame, instance_id, priority, len(text))
+
+    async def send_text_frame(self, frame: str, instance_id: int,
+                              priority: SpeechPriority = SpeechPriority.DIALOG, length: int = 0):
+        """Schedules a TTS frame pre-serialized with `_tts_message` on the cabin speaker."""
+        self.models[instance_id].tts_completed = False
+        await self.speech.submit(instance_id, tracing.tag_frame(frame), priority, length)
+
+    @staticmethod
+    def _tts_message(text: str, instance_id: int) -> dict:
+        return {
+            "name": MessageName.TTS_TEXT.value,
             "type": "object_struct_signal",
             "instance": instance_id,
             "fields": [
@@ -298,7 +615,13 @@ class Device:
                 {"name": "intonation", "value": "neutral"},
             ],
         }
-        self.models[instance_id].tts_completed = False
+
+    async def send_tts_interrupt(self, instance_id: int):
+        message = {
+            "name": MessageName.TTS_INTERRUPT.value,
+            "type": "object_void_signal",
+            "instance": instance_id,
+        }
         await self.send_message(message)
 
     async def send_ready_message(self, instance_id: int):
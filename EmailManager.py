@@ -1,53 +1,280 @@
+import asyncio
+import hashlib
+from collections import deque
+from typing import NamedTuple
+
+import constants as c
+from EmailThreads import EmailThreadIndex
+from SummaryCache import SummaryCache
 from enums import EmailClass
 from loguru import logger
 
+
+class Email(NamedTuple):
+    sender: str
+    subject: str
+    body: str
+    kind: str
+    sender_address: str | None = None
+    date: str | None = None
+    time: str | None = None
+
+    @property
+    def content_hash(self) -> str:
+        return hashlib.sha1(f"{self.sender}\0{self.subject}\0{self.body}".encode()).hexdigest()
+
+    @property
+    def key(self) -> str:
+        # identity of an email: the same content sent by the same address at the same date/time
+        return f"{self.sender_address}|{self.date}|{self.time}|{self.content_hash}"
+
+
 class EmailManager:
-    def __init__(self):
+    def __init__(self, store=None, warm_start: bool = True, summaries: SummaryCache | None = None):
+        """
+        Initializes the manager.
+
+        Args:
+            store: Optional EmailStore used to persist emails and summaries across reconnects.
+            warm_start: Whether to load the stored mailbox right away, otherwise the owner calls `warm_start()`.
+            summaries: Optional summary cache shared with other managers, keyed by thread content hash.
+        """
+        self.store = store  # optional EmailStore used to persist emails and summaries across reconnects
         self.original_emails = []
+        self.email_keys = set()
+        self.threads = EmailThreadIndex()  # emails grouped into threads at ingest, each read out once
+        self.summaries = summaries if summaries is not None else SummaryCache()
+        self.summary_hashes = set()  # content hashes this manager holds a reference on in `summaries`
         self.urgent_emails = []
         self.not_urgent_emails = []
         self.step = -1
-        self.report_msgs = []
+        self.report_msgs = deque()
         self.next_email = False
+        self.version = 0  # bumped whenever the mailbox or its classification changes
+        self.resume_message = None  # precomputed resume message, None when stale
+        self.reports = {}  # precomputed report messages per reading order, empty when stale
+        self.urgent_messages = frozenset()  # report messages reading out urgent emails
+        self.synced_keys = None  # keys sent by the ECU since MAIL_START, None outside of a mailbox sync
+        self._prune_summaries = False  # emails were dropped, stale stored summaries go at the next classification
+        self._classifying = asyncio.Lock()  # one classification at a time, they yield to the event loop
         # -1 means disabled / not ready
         # 0 means the emails are classified and ready
         # 1 means user is in the middle of workflow - resume sent and agent waits for urgent/non-urgent response
         # 2 means user is listening to emails one by one
 
-    def add_email(self, email_sender: str, email_subject: str, email_body: str, email_kind: str):
-        self.original_emails.append((email_sender, email_subject, email_body, email_kind))
+        if self.store and warm_start:
+            self.warm_start()
+
+    def warm_start(self, classify: bool = True):
+        """
+        Loads the stored mailbox.
+
+        Args:
+            classify: Whether to also load the summaries and classify the emails, a manager that only keeps the
+                store in sync with the ECU skips it.
+        """
+        if not self.store:
+            return
+        self.original_emails = self.store.load_emails()
+        self.email_keys = {email.key for email in self.original_emails}
+        self.threads = EmailThreadIndex()
+        for email in self.original_emails:
+            self.threads.add(email)
+        if classify and self.original_emails:
+            self._classify_emails(self.store.load_summaries())
+        logger.info(f"Restored {len(self.original_emails)} emails from the email store")
+
+    def add_email(self, email_sender: str, email_subject: str, email_body: str, email_kind: str,
+                  sender_address: str = None, date: str = None, time: str = None) -> bool:
+        email = Email(email_sender, email_subject, email_body, email_kind, sender_address, date, time)
+        key = email.key
+        if self.synced_keys is not None:
+            self.synced_keys.add(key)
+        if key in self.email_keys:
+            logger.debug(f"Email from {email_sender} is already known, skipping")
+            return False
+        self.email_keys.add(key)
+        self.original_emails.append(email)
+        self.threads.add(email)
+        self._invalidate()
+        if self.store:
+            self.store.add_email(email)
         logger.info(f"Email from {email_sender} added to the list of emails")
+        return True
 
-    def _get_email_classification(self, email_kind: str):
-        if email_kind.lower() == 'urgent':
-            return EmailClass.URGENT
-        else:
-            return EmailClass.NOT_URGENT
+    def add_emails(self, emails: list[Email]) -> int:
+        """Adds a batch of emails with a single store insert, returns the number of new emails."""
+        new_emails = []
+        for email in emails:
+            key = email.key
+            if self.synced_keys is not None:
+                self.synced_keys.add(key)
+            if key in self.email_keys:
+                continue
+            self.email_keys.add(key)
+            self.threads.add(email)
+            new_emails.append(email)
+        if not new_emails:
+            return 0
+        self.original_emails.extend(new_emails)
+        self._invalidate()
+        if self.store:
+            self.store.add_emails(new_emails)
+        logger.info(f"{len(new_emails)} of {len(emails)} emails added to the list of emails")
+        return len(new_emails)
+
+    def begin_sync(self):
+        """Opens a mailbox sync (MAIL_START): the known emails the ECU does not send again are dropped at the end."""
+        self.synced_keys = set()
+
+    def end_sync(self) -> int:
+        """
+        Closes the mailbox sync (MAIL_END), dropping the emails that were not sent since `begin_sync()`.
+
+        Returns:
+            The number of emails dropped, 0 when no sync was open.
+        """
+        synced_keys, self.synced_keys = self.synced_keys, None
+        if synced_keys is None:
+            return 0
+        dropped = [email.key for email in self.original_emails if email.key not in synced_keys]
+        if not dropped:
+            return 0
+        self.original_emails = [email for email in self.original_emails if email.key in synced_keys]
+        self.email_keys = synced_keys & self.email_keys
+        self.threads = EmailThreadIndex()
+        for email in self.original_emails:
+            self.threads.add(email)
+        self._invalidate()
+        # the summaries of the threads that are gone are released now, not at the next classification
+        kept = self.summary_hashes & {thread.content_hash for thread in self.threads.threads}
+        self.summaries.release(self.summary_hashes - kept)
+        self.summary_hashes = kept
+        if self.store:
+            self.store.remove_emails(dropped)
+            self._prune_summaries = True
+        logger.info(f"{len(dropped)} emails no longer in the ECU mailbox were dropped")
+        return len(dropped)
+
+    def _get_thread_classification(self, thread):
+        # a thread is urgent as soon as one of its emails is
+        return EmailClass.URGENT if thread.urgent else EmailClass.NOT_URGENT
+
+    def _get_thread_sender(self, thread) -> str:
+        if len(thread.emails) == 1:
+            return thread.latest.sender
+        senders = thread.senders
+        names = senders[0] if len(senders) == 1 else ", ".join(senders[:-1]) + " and " + senders[-1]
+        return f"{names} ({len(thread.emails)} emails)"
 
     def _get_email_summary(self, email_subject, email_body, email_sender):
         return f"Summary of the email with subject: {email_subject}, from {email_sender} is: {email_body[:50]}..."
 
+    def _get_thread_summary(self, thread):
+        # the root carries the context of the conversation, the latest reply where it stands
+        if len(thread.emails) == 1:
+            return self._get_email_summary(thread.root.subject, thread.root.body, thread.root.sender)
+        root, latest = thread.root, thread.latest
+        return (f"Summary of the thread with subject: {root.subject}, started by {root.sender} with: "
+                f"{root.body[:50]}... The latest reply from {latest.sender} is: {latest.body[:50]}...")
+
+    def _get_cached_summary(self, thread, content_hash: str, new_summaries: dict, stored_summaries: dict):
+        summary = self.summaries.get(content_hash)
+        if summary is None:
+            summary = stored_summaries.get(content_hash)
+            if summary is None:
+                summary = new_summaries[content_hash] = self._get_thread_summary(thread)
+            self.summaries.put(content_hash, summary)
+        return summary
+
     async def process_emails(self):
+        """Classifies the emails on the event loop, yielding to the other zones every `EMAIL_INGEST_CHUNK` threads."""
+        async with self._classifying:
+            for _ in self._classify():
+                await asyncio.sleep(0)
+
+    def _classify_emails(self, stored_summaries: dict | None = None):
+        for _ in self._classify(stored_summaries):
+            pass
+
+    def _classify(self, stored_summaries: dict | None = None):
         urgent_emails = []
         not_urgent_emails = []
-        for email in self.original_emails:
-            sender, subject, body, kind = email  # Include kind in unpacking
-            classification = self._get_email_classification(kind)  # Use kind for classification
-            summary = self._get_email_summary(subject, body, sender)
+        new_summaries = {}
+        used_summaries = set()
+        # the threads ingested while the classification yields get their own at the next MAIL_END
+        for i, thread in enumerate(list(self.threads.threads), 1):
+            if i % c.EMAIL_INGEST_CHUNK == 0:
+                yield
+            sender = self._get_thread_sender(thread)
+            classification = self._get_thread_classification(thread)
+            content_hash = thread.content_hash
+            summary = self._get_cached_summary(thread, content_hash, new_summaries, stored_summaries or {})
+            used_summaries.add(content_hash)
             email_details = (sender, summary)
             if classification == EmailClass.URGENT:
                 urgent_emails.append(email_details)
             else:
                 not_urgent_emails.append(email_details)
+        if self.store and new_summaries:
+            self.store.add_summaries(new_summaries)
+        if self.store and self._prune_summaries:
+            self.store.retain_summaries(used_summaries)
+            self._prune_summaries = False
+        yield
+        self.summaries.retain(self.summary_hashes, used_summaries)
+        self.summary_hashes = used_summaries
         self.urgent_emails = urgent_emails
         self.not_urgent_emails = not_urgent_emails
         self.step = 0
+        self._precompute()
+        logger.info(f"{len(self.original_emails)} emails grouped in {len(self.threads)} threads")
+
+    def _invalidate(self):
+        self.version += 1
+        self.resume_message = None
+        self.reports = {}
+
+    def _precompute(self):
+        """Speculatively builds the resume message and both report orderings ahead of the WORK feature."""
+        self.version += 1
+        self.resume_message = self._compose_resume_message()
+        urgent_messages = self.compose_reading_message(self.urgent_emails, "urgent emails")
+        not_urgent_messages = self.compose_reading_message(self.not_urgent_emails, "less urgent emails")
+        self.urgent_messages = frozenset(urgent_messages)
+        self.reports = {
+            EmailClass.URGENT: tuple(urgent_messages + not_urgent_messages),
+            EmailClass.NOT_URGENT: tuple(not_urgent_messages + urgent_messages),
+        }
+
+    def is_urgent(self, message: str) -> bool:
+        """Whether a report message reads out urgent emails."""
+        return message in self.urgent_messages
+
+    def work_entry_message(self) -> str | None:
+        """
+        Returns the precomputed resume message opening the email workflow, None if it is stale or if the workflow
+        starts straight with the report (only one kind of emails).
+        """
+        if not self.urgent_emails or not self.not_urgent_emails:
+            return None
+        return self.resume_message
 
     async def compose_resume_message(self):
+        if self.resume_message is not None:
+            return self.resume_message
+        return self._compose_resume_message()
+
+    def _compose_resume_message(self):
         total_emails = len(self.urgent_emails) + len(self.not_urgent_emails)
         prep_urgent = "are" if len(self.urgent_emails) > 1 else "is"
         prep_not_urgent = "are" if len(self.not_urgent_emails) > 1 else "is"
-        msg = f"Hello you have {total_emails} unread emails, \
+        if len(self.original_emails) > total_emails:
+            # urgent and not urgent counts are in threads
+            total_emails = f"{len(self.original_emails)} unread emails in {total_emails} conversations"
+        else:
+            total_emails = f"{total_emails} unread emails"
+        msg = f"Hello you have {total_emails}, \
                 {len(self.urgent_emails)} of them {prep_urgent} requiring your immediate attention \
                 and {len(self.not_urgent_emails)} of them {prep_not_urgent} not. \
                 Which emails would you like me to read first? Urgent emails or less urgent emails?"
@@ -67,24 +294,45 @@ class EmailManager:
         return return_messages
 
     async def generate_report(self, label):
+        if label in self.reports:
+            self.report_msgs = deque(self.reports[label])
+            return True
         if label == EmailClass.URGENT:
             urgent_messages = self.compose_reading_message(self.urgent_emails, "urgent emails")
             not_urgent_messages = self.compose_reading_message(self.not_urgent_emails, "less urgent emails")
-            self.report_msgs = urgent_messages + not_urgent_messages
+            self.urgent_messages = frozenset(urgent_messages)
+            self.report_msgs = deque(urgent_messages + not_urgent_messages)
             return True
         elif label == EmailClass.NOT_URGENT:
             not_urgent_messages = self.compose_reading_message(self.not_urgent_emails, "less urgent emails")
             urgent_messages = self.compose_reading_message(self.urgent_emails, "urgent emails")
-            self.report_msgs = not_urgent_messages + urgent_messages
+            self.urgent_messages = frozenset(urgent_messages)
+            self.report_msgs = deque(not_urgent_messages + urgent_messages)
             return True
         else:
-            self.report_msgs = ["Please choose between urgent emails or less urgent emails"]
+            self.report_msgs = deque(["Please choose between urgent emails or less urgent emails"])
             return False
 
+    async def reset_workflow(self):
+        """Rewinds the email workflow while keeping the ingested emails and summaries."""
+        self.step = 0 if self.urgent_emails or self.not_urgent_emails else -1
+        self.report_msgs = deque()
+        self.next_email = False
+
     async def reset(self):
         self.original_emails = []
+        self.email_keys = set()
+        self.threads = EmailThreadIndex()
+        self.summaries.release(self.summary_hashes)
+        self.summary_hashes = set()
         self.urgent_emails = []
         self.not_urgent_emails = []
         self.step = -1
-        self.report_msgs = []
+        self.report_msgs = deque()
         self.next_email = False
+        self.synced_keys = None
+        self._prune_summaries = False
+        self._invalidate()
+        if self.store:
+            self.store.clear()
+
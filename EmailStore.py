@@ -0,0 +1,105 @@
+import os
+import sqlite3
+
+from loguru import logger
+
+from EmailManager import Email
+
+
+class EmailStore:
+    """
+    Persistent on-disk store for ingested emails and their summaries.
+
+    Emails are keyed by sender address, date, time and content hash, so the mailbox and
+    every summary survive websocket reconnects and process restarts.
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) the SQLite database backing the store.
+
+        Args:
+            path: Location of the database file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # the mailbox may be loaded from a worker thread at startup, the store is never used concurrently
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS emails ("
+            "id INTEGER PRIMARY KEY, "
+            "key TEXT NOT NULL UNIQUE, "
+            "sender TEXT, subject TEXT, body TEXT, kind TEXT, "
+            "sender_address TEXT, date TEXT, time TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "content_hash TEXT PRIMARY KEY, "
+            "summary TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        logger.info(f"Email store opened at {path}")
+
+    def load_emails(self) -> list[Email]:
+        """Returns all stored emails in ingestion order."""
+        rows = self.conn.execute(
+            "SELECT sender, subject, body, kind, sender_address, date, time FROM emails ORDER BY id"
+        )
+        return [Email(*row) for row in rows]
+
+    def load_summaries(self) -> dict[str, str]:
+        """Returns the cached summaries keyed by content hash."""
+        return dict(self.conn.execute("SELECT content_hash, summary FROM summaries"))
+
+    def add_email(self, email: Email) -> bool:
+        """Persists an email, returns False if an email with the same key is already stored."""
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO emails (key, sender, subject, body, kind, sender_address, date, time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (email.key, *email),
+        )
+        self.conn.commit()
+        return cursor.rowcount == 1
+
+    def add_emails(self, emails: list[Email]) -> int:
+        """Persists a batch of emails in a single transaction, returns the number of new rows."""
+        with self.conn:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO emails (key, sender, subject, body, kind, sender_address, date, time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(email.key, *email) for email in emails],
+            )
+        return cursor.rowcount
+
+    def add_summaries(self, summaries: dict[str, str]):
+        """Persists summaries keyed by content hash in a single transaction."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO summaries (content_hash, summary) VALUES (?, ?)",
+                summaries.items(),
+            )
+
+    def remove_emails(self, keys: list[str]):
+        """Deletes the emails with the given keys in a single transaction."""
+        with self.conn:
+            self.conn.executemany("DELETE FROM emails WHERE key = ?", ((key,) for key in keys))
+
+    def retain_summaries(self, content_hashes: set[str]):
+        """Deletes the summaries of the content hashes not in `content_hashes`."""
+        stale = [(content_hash,) for (content_hash,) in self.conn.execute("SELECT content_hash FROM summaries")
+                 if content_hash not in content_hashes]
+        if stale:
+            with self.conn:
+                self.conn.executemany("DELETE FROM summaries WHERE content_hash = ?", stale)
+
+    def clear(self):
+        self.conn.execute("DELETE FROM emails")
+        self.conn.execute("DELETE FROM summaries")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
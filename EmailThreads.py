@@ -0,0 +1,142 @@
+import hashlib
+import re
+import string
+import sys
+
+SUBJECT_PREFIX = re.compile(r"^\s*(?:(?:re|fw|fwd|aw|wg|tr)\s*(?:\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+PUNCTUATION = str.maketrans(string.punctuation, " " * len(string.punctuation))
+
+SHINGLE_SIZE = 3  # words per shingle
+MIN_SHINGLES = 8  # shorter bodies are never matched as near-duplicates
+BANDS = 4  # LSH bands of the signature
+ROWS = 4  # signature bins per band
+BINS = BANDS * ROWS
+DUPLICATE_SIMILARITY = 0.8  # estimated Jaccard similarity from which two bodies are near-duplicates
+_EMPTY = sys.maxsize + 1  # value of a signature bin no shingle fell into, above any hash
+_EMPTY_BAND = (_EMPTY,) * ROWS
+
+
+def normalize_subject(subject: str | None) -> str:
+    """Strips the reply/forward prefixes and folds case and whitespace: "RE: Fwd:  Meeting" -> "meeting"."""
+    return " ".join(SUBJECT_PREFIX.sub("", subject or "").lower().split())
+
+
+def thread_key(email) -> str:
+    """Hash of the normalized subject and the sender, the same for every email of a thread."""
+    sender = (email.sender_address or email.sender or "").lower()
+    return hashlib.sha1(f"{normalize_subject(email.subject)}\0{sender}".encode()).hexdigest()
+
+
+def shingles(text: str | None) -> set[int]:
+    """Hashes of the overlapping word n-grams of a text, only comparable within the process (salted str hashes)."""
+    words = (text or "").lower().translate(PUNCTUATION).split()
+    return set(map(hash, zip(*(words[i:] for i in range(SHINGLE_SIZE)))))
+
+
+def signature(text: str | None) -> tuple[int, ...] | None:
+    """
+    One-permutation MinHash signature of a text, None if it is too short to be compared.
+
+    Every shingle is hashed once and the hash range is split in `BINS` bins, each keeping its smallest hash:
+    two texts agree on a bin with a probability close to the Jaccard similarity of their shingle sets.
+    """
+    hashes = shingles(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    bins = [_EMPTY] * BINS
+    for h in hashes:
+        b = h % BINS
+        if h < bins[b]:
+            bins[b] = h
+    return tuple(bins)
+
+
+def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures, bins empty on both sides are ignored."""
+    matches = compared = 0
+    for x, y in zip(a, b):
+        if x == _EMPTY and y == _EMPTY:
+            continue
+        compared += 1
+        matches += x == y
+    return matches / compared if compared else 0.0
+
+
+class EmailThread:
+    """Emails read out as one: a conversation (same normalized subject and sender) and its near-duplicates."""
+
+    __slots__ = ("key", "emails")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.emails = []
+
+    @property
+    def root(self):
+        return self.emails[0]
+
+    @property
+    def latest(self):
+        return self.emails[-1]
+
+    @property
+    def content_hash(self) -> str:
+        """Hash of the emails the thread summary is made of: the root and the latest reply."""
+        if len(self.emails) == 1:
+            return self.root.content_hash
+        return hashlib.sha1(f"{self.root.content_hash}\0{self.latest.content_hash}".encode()).hexdigest()
+
+    @property
+    def urgent(self) -> bool:
+        return any(email.kind.lower() == "urgent" for email in self.emails)
+
+    @property
+    def senders(self) -> list[str]:
+        return list(dict.fromkeys(email.sender for email in self.emails))
+
+
+class EmailThreadIndex:
+    """
+    Groups the emails into threads as they are ingested.
+
+    An email joins the thread of its key (see `thread_key()`), or else the thread of a previous email with a
+    near-duplicate body, found through the LSH buckets of the body signatures. Only the emails opening a thread
+    or joining one by body have their signature computed, replies to a known thread cost a single hash.
+    """
+
+    def __init__(self):
+        self.threads = []  # in order of creation
+        self.by_key = {}  # thread key -> thread, including the keys of the near-duplicates
+        self.buckets = {}  # (band, band bins) -> (thread, signature)
+
+    def __len__(self) -> int:
+        return len(self.threads)
+
+    def add(self, email) -> EmailThread:
+        """Adds an email to its thread, creating the thread if needed, and returns it."""
+        key = thread_key(email)
+        thread = self.by_key.get(key)
+        if thread is None:
+            body_signature = signature(email.body)
+            buckets = self._buckets(body_signature) if body_signature else ()
+            thread = self._near_duplicate(body_signature, buckets)
+            if thread is None:
+                thread = EmailThread(key)
+                self.threads.append(thread)
+            self.by_key[key] = thread
+            for bucket in buckets:
+                self.buckets.setdefault(bucket, (thread, body_signature))
+        thread.emails.append(email)
+        return thread
+
+    @staticmethod
+    def _buckets(body_signature: tuple[int, ...]) -> list[tuple]:
+        return [(band, bins) for band in range(BANDS)
+                if (bins := body_signature[band * ROWS:(band + 1) * ROWS]) != _EMPTY_BAND]
+
+    def _near_duplicate(self, body_signature: tuple[int, ...], buckets: list[tuple]) -> EmailThread | None:
+        for bucket in buckets:
+            candidate = self.buckets.get(bucket)
+            if candidate and similarity(body_signature, candidate[1]) >= DUPLICATE_SIMILARITY:
+                return candidate[0]
+        return None
@@ -1,8 +1,28 @@
 import asyncio
 import sys
 import os
-import termios
-import tty
+import threading
+
+_lines: asyncio.Queue | None = None  # headless stdin lines, fed by a single reader thread shared by every listener
+
+
+def _stdin_lines() -> asyncio.Queue:
+    """Starts the stdin reader on first use, a cancelled listen leaves no blocked read behind to eat a line."""
+    global _lines
+    if _lines is None:
+        _lines = asyncio.Queue()
+        threading.Thread(target=_read_lines, args=(asyncio.get_running_loop(), _lines), name="stdin_reader",
+                         daemon=True).start()
+    return _lines
+
+
+def _read_lines(loop: asyncio.AbstractEventLoop, lines: asyncio.Queue):
+    try:
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(lines.put_nowait, line.rstrip("\n"))
+        loop.call_soon_threadsafe(lines.put_nowait, None)  # end of input
+    except RuntimeError:  # the event loop was closed
+        pass
 
 
 class Listener:
@@ -10,8 +30,12 @@ class Listener:
         self.loop = asyncio.get_event_loop()
         self.stop_event = asyncio.Event()
         self.old_settings = None
+        # headless deployments have no terminal: no raw mode or prompt, transcripts are read line by line
+        self.tty = sys.stdin.isatty()
 
     async def start(self):
+        if not self.tty:
+            return await self._get_line()
         try:
             # Clear any pending input
             self._clear_input()
@@ -46,12 +70,15 @@ class Listener:
             fcntl.fcntl(fd, fcntl.F_SETFL, flags)
 
     def _disable_echo(self):
+        import termios
+        import tty
         fd = sys.stdin.fileno()
         self.old_settings = termios.tcgetattr(fd)
         tty.setraw(fd)
 
     def _enable_echo(self):
         if self.old_settings:
+            import termios
             termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, self.old_settings)
 
     def _print_prompt(self):
@@ -76,6 +103,14 @@ class Listener:
                 print(char, end='', flush=True)  # Echo the character
         return None
 
+    async def _get_line(self):
+        lines = _stdin_lines()
+        line = await lines.get()
+        if line is None:
+            lines.put_nowait(None)  # stdin stays at its end for the next listeners
+        return line
+
     async def stop(self):
         self.stop_event.set()
-        print()
+        if self.tty:
+            print()  # leaves the prompt line
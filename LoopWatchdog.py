@@ -0,0 +1,78 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from loguru import logger
+
+import constants as c
+import metrics
+
+
+class LoopWatchdog:
+    """
+    Samples the event loop lag continuously and detects blocking calls.
+
+    A coroutine wakes up every `interval` and records how late it was (`loop.lag_ms`). A watcher thread checks
+    that these wake-ups keep coming: when the loop has been stuck for longer than `threshold`, it captures the
+    stack of the loop thread, which points at the blocking call, logs it and counts it (`loop.blocked`).
+    """
+
+    def __init__(self, interval: float = c.LOOP_LAG_INTERVAL, threshold: float = c.LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_stack = None
+        self._heartbeat = time.monotonic()
+        self._reported = False
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        """Starts sampling the running loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        # a fresh event per watcher: clearing the previous one could revive a watcher that has not seen its stop yet
+        self._stop = threading.Event()
+        self._task = asyncio.get_running_loop().create_task(self._sample(), name="loop_watchdog")
+        self._thread = threading.Thread(target=self._watch, args=(self._stop,), name="loop_watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat(start)
+
+    def _beat(self, start: float):
+        """Records the lag of a sampler wake-up scheduled at `start`."""
+        now = time.monotonic()
+        lag_ms = max(0.0, now - start - self.interval) * 1000
+        self._heartbeat = now
+        self._reported = False
+        metrics.observe("loop.lag_ms", lag_ms)
+        metrics.set_gauge("loop.lag_ms", lag_ms)
+
+    def _watch(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            self._check()
+
+    def _check(self):
+        """Reports the loop stack if the sampler has not woken up for longer than the threshold."""
+        stalled = time.monotonic() - self._heartbeat - self.interval
+        if stalled > self.threshold and not self._reported:
+            self._reported = True  # once per stall, reset by the next loop wake-up
+            frame = sys._current_frames().get(self._loop_thread_id)
+            self.last_stack = "".join(traceback.format_stack(frame)) if frame else None
+            metrics.inc("loop.blocked")
+            logger.warning(f"Event loop blocked for more than {stalled * 1000:.0f} ms:\n{self.last_stack}")
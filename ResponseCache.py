@@ -0,0 +1,129 @@
+import math
+import re
+import zlib
+
+from loguru import logger
+
+import constants as c
+import metrics
+from ContentCache import ContentCache
+from User import User
+
+EMBEDDING_DIM = 512
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases a transcript and strips punctuation and extra whitespace."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", query.lower())).strip()
+
+
+def embed(text: str) -> dict[int, float]:
+    """
+    Local bag-of-words embedding: unigrams and bigrams hashed into EMBEDDING_DIM buckets, L2-normalized.
+    Returns the sparse vector as {bucket: weight}.
+    """
+    words = text.split()
+    vector = {}
+    for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        bucket = zlib.crc32(token.encode()) % EMBEDDING_DIM
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {bucket: weight / norm for bucket, weight in vector.items()} if norm else {}
+
+
+def _cosine(a: dict[int, float], b: dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+def profile_bits(user: User | None) -> tuple:
+    """The parts of a user profile a response may depend on: interests bitset and age band."""
+    if user is None:
+        return 0, None
+    if user.age is None:
+        age_band = None
+    else:
+        age_band = "child" if user.age < 13 else "teen" if user.age < 18 else "adult"
+    return user.interests, age_band
+
+
+class ResponseCache:
+    """
+    Cache in front of response generation, keyed on the normalized query, profile bits and agent feature.
+
+    The exact tier is a size-bounded LRU with TTL. The optional similarity tier matches paraphrases by cosine
+    similarity of local embeddings within the same profile and feature.
+    """
+
+    def __init__(self, max_entries: int = c.RESPONSE_CACHE_MAX_ENTRIES, ttl: float = c.RESPONSE_CACHE_TTL,
+                 similarity_threshold: float | None = c.RESPONSE_CACHE_SIMILARITY, enabled: bool = c.RESPONSE_CACHE):
+        """
+        Initializes the cache.
+
+        Args:
+            max_entries: Maximum number of cached responses.
+            ttl: Lifetime of a cached response in seconds.
+            similarity_threshold: Minimum cosine similarity for a similarity-tier hit, None disables the tier.
+            enabled: Bypass flag, a disabled cache never hits and stores nothing.
+        """
+        self.exact = ContentCache(max_entries=max_entries, max_bytes=max_entries * c.RESPONSE_CACHE_MAX_ENTRY_BYTES,
+                                  ttl=ttl, name="response_cache.exact")
+        self.similarity_threshold = similarity_threshold
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.vectors = {}  # (profile, feature) -> {normalized query: embedding}
+
+    @staticmethod
+    def _key(query: str, user: User | None, feature) -> tuple:
+        return normalize_query(query), profile_bits(user), str(feature)
+
+    def get(self, query: str, user: User | None, feature, bypass: bool = False) -> str | None:
+        if not self.enabled or bypass or not query:
+            metrics.inc("response_cache.bypass")
+            return None
+        key = self._key(query, user, feature)
+        response = self.exact.get(key)
+        if response is None and self.similarity_threshold is not None:
+            response = self._get_similar(key)
+        metrics.inc("response_cache.hit" if response is not None else "response_cache.miss")
+        return response
+
+    def _get_similar(self, key: tuple) -> str | None:
+        text, profile, feature = key
+        bucket = self.vectors.get((profile, feature))
+        if not bucket:
+            return None
+        vector = embed(text)
+        best_text, best_score = None, self.similarity_threshold
+        for candidate, candidate_vector in bucket.items():
+            score = _cosine(vector, candidate_vector)
+            if score >= best_score:
+                best_text, best_score = candidate, score
+        if best_text is None:
+            return None
+        response = self.exact.get((best_text, profile, feature))
+        if response is None:
+            del bucket[best_text]  # evicted or expired from the exact tier
+            return None
+        metrics.inc("response_cache.similar_hit")
+        logger.debug(f"Similar cached response for '{text}' (matched '{best_text}', score {best_score:.2f})")
+        return response
+
+    def put(self, query: str, user: User | None, feature, response: str, bypass: bool = False):
+        if not self.enabled or bypass or not query or not response:
+            return
+        key = self._key(query, user, feature)
+        self.exact.put(key, response, len(response))
+        if self.similarity_threshold is not None:
+            text, profile, feature = key
+            bucket = self.vectors.setdefault((profile, feature), {})
+            bucket[text] = embed(text)
+            if len(bucket) > self.max_entries:
+                del bucket[next(iter(bucket))]
+
+    def clear(self):
+        self.exact.clear()
+        self.vectors = {}
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import multiprocessing
+import re
+import socket
+import struct
+import sys
+import zlib
+
+from loguru import logger
+
+from TaskSupervisor import TaskSupervisor
+from Transport import Transport
+from enums import MessageName, SpeechPriority
+
+HEADER = struct.Struct("!I")  # every IPC frame is a 4-byte big-endian length followed by the UTF-8 message
+INSTANCE_PATTERN = re.compile(r'"instance"\s*:\s*(-?\d+)')
+# router <-> worker control messages start with "!", ECU frames are JSON objects:
+#   worker -> router: "!speak <instance> <priority> <length>\n<tts frame>", "!cancel <instance>", "!clear"
+#   router -> worker: "!released <instance>"
+CONTROL = "!"
+# cabin-wide state the ECU addresses to one instance, every worker's Device has to follow it
+DEVICE_STATE_PATTERN = re.compile(r'"name"\s*:\s*"(?:' + MessageName.AGENT_FEATURE.value + "|"
+                                  + MessageName.NEXT_EMAIL.value + ')"')
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes | None:
+    """Reads one length-prefixed frame, returns None once the peer closed the channel."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        return await reader.readexactly(HEADER.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(HEADER.pack(len(payload)) + payload)
+
+
+class ShardConnection(Transport):
+    """
+    Worker side of the IPC channel.
+    A transport like the ECU websocket, so the worker's Device runs unchanged on top of it.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, on_released=None):
+        self.reader = reader
+        self.writer = writer
+        self.on_released = on_released  # `on_released(instance_id)` for the utterances the router dropped
+        self._closed = False
+
+    async def send(self, data: str):
+        write_frame(self.writer, data.encode())
+        await self.writer.drain()
+
+    async def __anext__(self) -> str:
+        while True:
+            frame = await read_frame(self.reader)
+            if frame is None:
+                self._closed = True
+                raise StopAsyncIteration
+            message = frame.decode()
+            if not message.startswith(CONTROL):
+                return message
+            command, _, argument = message[1:].partition(" ")
+            if command == "released" and self.on_released:
+                self.on_released(int(argument))
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def close(self):
+        self._closed = True
+        self.writer.close()
+
+
+class RemoteSpeech:
+    """
+    Worker side of the cabin-wide speech arbitration.
+
+    Stands in for the worker's SpeechScheduler: the utterances of every worker are arbitrated by the scheduler of
+    the router process, which also handles TTS_COMPLETED before forwarding it.
+    """
+
+    def __init__(self, connection: ShardConnection):
+        self.connection = connection
+
+    async def submit(self, instance_id: int, frame: str, priority: SpeechPriority, length: int = 0):
+        await self.connection.send(f"{CONTROL}speak {instance_id} {int(priority)} {length}\n{frame}")
+
+    async def completed(self, instance_id: int):
+        pass  # already handled by the router
+
+    async def cancel(self, instance_id: int):
+        await self.connection.send(f"{CONTROL}cancel {instance_id}")
+
+    def clear(self):
+        write_frame(self.connection.writer, f"{CONTROL}clear".encode())
+
+
+def _worker_main(sock: socket.socket, index: int, log_level: str | None):
+    if log_level:
+        logger.remove()
+        logger.add(sys.stderr, level=log_level)
+    asyncio.run(_worker(sock, index))
+
+
+async def _worker(sock: socket.socket, index: int):
+    from Device import Device
+
+    reader, writer = await asyncio.open_connection(sock=sock)
+    # in-memory mailbox, the router is the only writer of the email store and replays it at startup
+    device = Device(url=None, email_store_path=None)
+    device.ws = ShardConnection(reader, writer, on_released=device.on_speech_released)
+    device.speech = RemoteSpeech(device.ws)
+    logger.info(f"Shard worker {index} started")
+    await device.listen_ws(device.ws)
+    logger.info(f"Shard worker {index} stopped")
+
+
+class ShardRouter:
+    """
+    Runs the Model instances of a Device in worker processes.
+
+    The Device process stays the websocket endpoint: ECU frames are forwarded to the worker owning their
+    instance (broadcast frames and the cabin-wide agent feature and next-email state go to every worker) and the
+    workers' outbound frames are relayed back to the ECU.
+    The workers' speech goes through the scheduler of the Device process, so that arbitration stays cabin-wide.
+    """
+
+    def __init__(self, n_workers: int, log_level: str | None = None):
+        """
+        Initializes the router.
+
+        Args:
+            n_workers: Number of worker processes.
+            log_level: Log level of the workers, None keeps the loguru default.
+        """
+        assert n_workers > 0, "A shard router needs at least one worker"
+        self.n_workers = n_workers
+        self.log_level = log_level
+        self.processes = []
+        self.writers = []
+        self.tasks = TaskSupervisor("shard_router")
+
+    async def start(self, send_frame, speech=None):
+        """
+        Spawns the workers.
+
+        Args:
+            send_frame: Coroutine function relaying a serialized worker frame to the ECU.
+            speech: SpeechScheduler arbitrating the workers' utterances, None sends them straight to the ECU.
+        """
+        self.send_frame = send_frame
+        self.speech = speech
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.n_workers):
+            parent_sock, child_sock = socket.socketpair()
+            process = context.Process(target=_worker_main, name=f"shard_{index}", daemon=True,
+                                      args=(child_sock, index, self.log_level))
+            process.start()
+            child_sock.close()
+            reader, writer = await asyncio.open_connection(sock=parent_sock)
+            self.processes.append(process)
+            self.writers.append(writer)
+            self.tasks.spawn(self._relay(reader, send_frame, index), f"relay_{index}")
+        logger.info(f"Started {self.n_workers} shard workers")
+
+    async def _relay(self, reader: asyncio.StreamReader, send_frame, index: int):
+        while (frame := await read_frame(reader)) is not None:
+            message = frame.decode()
+            if message.startswith(CONTROL):
+                await self._control(message)
+                continue
+            if DEVICE_STATE_PATTERN.search(message):
+                # a feature switched by a worker (e.g. back to DIALOG at the end of the readout) applies to all
+                for other, writer in enumerate(self.writers):
+                    if other != index:
+                        write_frame(writer, frame)
+            await send_frame(message)
+
+    async def _control(self, message: str):
+        command, _, argument = message[1:].partition(" ")
+        if command == "speak":
+            header, _, frame = argument.partition("\n")
+            instance_id, priority, length = map(int, header.split())
+            if self.speech:
+                await self.speech.submit(instance_id, frame, SpeechPriority(priority), length)
+            else:
+                await self.send_frame(frame)
+        elif command == "cancel" and self.speech:
+            await self.speech.cancel(int(argument))
+        elif command == "clear" and self.speech:
+            self.speech.clear()
+
+    def released(self, instance_id: int):
+        """Tells the worker owning an instance that its utterance was dropped without completing."""
+        write_frame(self.writers[self.worker_for(instance_id)], f"{CONTROL}released {instance_id}".encode())
+
+    def worker_for(self, instance_id) -> int:
+        """Stable instance to worker assignment."""
+        return zlib.crc32(str(instance_id).encode()) % self.n_workers
+
+    @staticmethod
+    def instance_of(message_data: str):
+        # the instance key only appears at the top level of ECU frames, avoid a full parse on the router
+        match = INSTANCE_PATTERN.search(message_data)
+        if match:
+            return int(match.group(1))
+        try:
+            return json.loads(message_data.rstrip('\n\x00')).get("instance")
+        except Exception:
+            return None
+
+    async def route(self, message_data: str):
+        """Forwards an ECU frame to the worker owning its instance, or to every worker for broadcasts."""
+        instance_id = self.instance_of(message_data)
+        payload = message_data.encode()
+        if instance_id is None or instance_id == -1 or DEVICE_STATE_PATTERN.search(message_data):
+            writers = self.writers
+        else:
+            writers = [self.writers[self.worker_for(instance_id)]]
+        for writer in writers:
+            write_frame(writer, payload)
+        for writer in writers:
+            await writer.drain()
+
+    async def stop(self):
+        for writer in self.writers:
+            writer.close()
+        await self.tasks.cancel()
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.writers = []
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from loguru import logger
+
+import constants as c
+from SummaryCache import SummaryCache
+
+
+class SharedResources:
+    """
+    Resources shared by every Device of the process.
+
+    Only read-only or content-addressed state lives here: the content pack and the email summaries keyed by content
+    hash. Sessions, zones, users and mailboxes stay on each Device.
+    """
+
+    def __init__(self, content_pack_path: str = c.CONTENT_PACK_PATH):
+        """
+        Initializes the resources, everything is loaded on first use.
+
+        Args:
+            content_pack_path: Location of the content pack.
+        """
+        self.content_pack_path = content_pack_path
+        self.content_pack = None
+        self._pack_lock = asyncio.Lock()
+        self.summaries = SummaryCache()  # the same thread gets the same summary on every device
+
+    def _read_content_pack(self) -> dict:
+        with open(self.content_pack_path) as f:
+            return json.load(f)
+
+    async def load_content_pack(self) -> dict:
+        """Returns the content pack, reading it once for all devices."""
+        if self.content_pack is None:
+            async with self._pack_lock:
+                if self.content_pack is None:
+                    loop = asyncio.get_running_loop()
+                    self.content_pack = await loop.run_in_executor(None, self._read_content_pack)
+                    logger.info(f"Content pack loaded from {self.content_pack_path}")
+        return self.content_pack
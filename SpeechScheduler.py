@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+import constants as c
+import metrics
+from TaskSupervisor import TaskSupervisor
+from enums import SpeechPriority
+
+
+@dataclass(slots=True)
+class Utterance:
+    instance_id: int
+    priority: SpeechPriority
+    frame: str  # serialized TTS frame
+    length: int  # number of characters to synthesize, used to bound the playback time
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class SpeechScheduler:
+    """
+    Cabin-wide TTS arbitration.
+
+    One utterance plays at a time. The next one is picked by priority (urgent email > dialog) and
+    round-robin across zones within a priority. A more urgent utterance preempts the playing one through
+    TTS_INTERRUPT. Playback ends on TTS_COMPLETED, or after an estimated playback time if the ECU never
+    reports it.
+    """
+
+    def __init__(self, send_frame, send_interrupt, on_released=None, preempt: bool = True, name: str = "speech"):
+        """
+        Initializes the scheduler.
+
+        Args:
+            send_frame: Coroutine function sending a serialized frame to the ECU.
+            send_interrupt: Coroutine function `send_interrupt(instance_id)` sending TTS_INTERRUPT.
+            on_released: Optional callback `on_released(instance_id)` for utterances dropped without completing.
+            preempt: Whether a more urgent utterance interrupts the playing one.
+            name: Name of the task supervisor, unique per Device.
+        """
+        self.send_frame = send_frame
+        self.send_interrupt = send_interrupt
+        self.on_released = on_released
+        self.preempt = preempt
+        # priority -> zone (instance_id) -> queued utterances, zones rotate for fairness
+        self.queues = {priority: OrderedDict() for priority in SpeechPriority}
+        self.current = None
+        self._timeout = None
+        self.tasks = TaskSupervisor(name)
+
+    def pending(self, instance_id: int | None = None) -> int:
+        if instance_id is None:
+            return sum(len(queue) for zones in self.queues.values() for queue in zones.values())
+        return sum(len(zones.get(instance_id, ())) for zones in self.queues.values())
+
+    async def submit(self, instance_id: int, frame: str, priority: SpeechPriority, length: int = 0):
+        """Queues a serialized TTS frame, playing it right away if the cabin is silent."""
+        utterance = Utterance(instance_id, priority, frame, length)
+        if self.current is None:
+            await self._play(utterance)
+            return
+        if self.preempt and priority < self.current.priority:
+            interrupted = self.current
+            logger.info(f"Preempting {interrupted.priority.name} speech of instance {interrupted.instance_id}")
+            metrics.inc("tts.preempted")
+            self._stop_current()
+            await self.send_interrupt(interrupted.instance_id)
+            self._release(interrupted.instance_id)
+            await self._play(utterance)
+            return
+        self.queues[priority].setdefault(instance_id, deque()).append(utterance)
+
+    async def completed(self, instance_id: int):
+        """Handles TTS_COMPLETED of an instance and plays the next utterance."""
+        if self.current is None or self.current.instance_id != instance_id:
+            return
+        self._stop_current()
+        await self._play_next()
+
+    async def cancel(self, instance_id: int) -> bool:
+        """
+        Drops the queued utterances of an instance and interrupts its playback.
+
+        Returns:
+            True if the instance was speaking.
+        """
+        for zones in self.queues.values():
+            zones.pop(instance_id, None)
+        if self.current is None or self.current.instance_id != instance_id:
+            return False
+        self._stop_current()
+        await self.send_interrupt(instance_id)
+        await self._play_next()
+        return True
+
+    async def _play(self, utterance: Utterance):
+        wait_ms = (time.perf_counter() - utterance.enqueued_at) * 1000
+        metrics.observe(f"tts.queue_wait_ms.{utterance.priority.name.lower()}", wait_ms)
+        self.current = utterance
+        timeout = c.TTS_PLAYBACK_BASE + utterance.length * c.TTS_PLAYBACK_PER_CHAR
+        self._timeout = asyncio.get_running_loop().call_later(timeout, self._on_timeout, utterance)
+        await self.send_frame(utterance.frame)
+
+    async def _play_next(self):
+        for zones in self.queues.values():  # ordered from the most urgent priority
+            for instance_id, queue in zones.items():
+                utterance = queue.popleft()
+                if queue:
+                    zones.move_to_end(instance_id)  # let the other zones speak first
+                else:
+                    del zones[instance_id]
+                await self._play(utterance)
+                return
+
+    def _stop_current(self):
+        if self._timeout:
+            self._timeout.cancel()
+            self._timeout = None
+        self.current = None
+
+    def _release(self, instance_id: int):
+        if self.on_released:
+            self.on_released(instance_id)
+
+    def _on_timeout(self, utterance: Utterance):
+        if self.current is not utterance:
+            return
+        logger.warning(f"No TTS completion from instance {utterance.instance_id}, releasing the speaker")
+        metrics.inc("tts.timeouts")
+        self._stop_current()
+        self._release(utterance.instance_id)
+        self.tasks.spawn(self._play_next(), "play_next")
+
+    def clear(self):
+        self._stop_current()
+        for zones in self.queues.values():
+            zones.clear()
@@ -0,0 +1,75 @@
+import json
+import os
+import sqlite3
+import threading
+
+from loguru import logger
+
+
+class StateSnapshot:
+    """
+    Warm-restart snapshot of the Device runtime state.
+
+    The state is split into sections (device-wide state and one section per instance), each stored as a compact
+    JSON row of a SQLite file. A write only touches the sections that changed since the previous one, and the
+    serialization and I/O are meant to run in a worker thread, off the event loop.
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) the SQLite database backing the snapshot.
+
+        Args:
+            path: Location of the database file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # used from the executor threads, one call at a time under the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sections (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        self.written = {}  # section key -> serialized value as last written
+        self._lock = threading.Lock()
+        logger.info(f"State snapshot opened at {path}")
+
+    def load(self) -> dict:
+        """Returns the stored sections keyed by section key."""
+        with self._lock:
+            rows = self.conn.execute("SELECT key, value FROM sections").fetchall()
+            self.written = dict(rows)
+        return {key: json.loads(value) for key, value in rows}
+
+    def write(self, sections: dict) -> int:
+        """
+        Persists the sections that changed since the last write and deletes the ones that are gone.
+
+        Args:
+            sections: Section key -> JSON-serializable state, the whole state at the time of the call.
+
+        Returns:
+            The number of sections written or deleted.
+        """
+        with self._lock:
+            serialized = {key: json.dumps(value, separators=(",", ":")) for key, value in sections.items()}
+            changed = [(key, value) for key, value in serialized.items() if self.written.get(key) != value]
+            removed = [(key,) for key in self.written if key not in serialized]
+            if not changed and not removed:
+                return 0
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO sections (key, value) VALUES (?, ?)", changed)
+                self.conn.executemany("DELETE FROM sections WHERE key = ?", removed)
+            self.written = serialized
+            return len(changed) + len(removed)
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM sections")
+            self.conn.commit()
+            self.written = {}
+
+    def close(self):
+        self.conn.close()
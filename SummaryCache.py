@@ -0,0 +1,37 @@
+from collections import Counter
+
+
+class SummaryCache:
+    """
+    Email summaries keyed by thread content hash, shared by the EmailManagers of the process.
+
+    Every manager holds a reference on the summaries of its current classification and a summary goes as soon as
+    no manager references it anymore, so the cache never outgrows the live mailboxes.
+    """
+
+    def __init__(self):
+        self.summaries = {}  # content hash -> summary
+        self.refs = Counter()  # content hash -> number of managers using the summary
+
+    def __len__(self) -> int:
+        return len(self.summaries)
+
+    def get(self, content_hash: str) -> str | None:
+        return self.summaries.get(content_hash)
+
+    def put(self, content_hash: str, summary: str):
+        self.summaries[content_hash] = summary
+
+    def retain(self, held: set[str], used: set[str]):
+        """Moves the references of one manager from the content hashes it `held` to the ones it now `used`."""
+        for content_hash in used - held:
+            self.refs[content_hash] += 1
+        self.release(held - used)
+
+    def release(self, content_hashes):
+        """Drops one reference on each content hash, forgetting the summaries no manager uses anymore."""
+        for content_hash in content_hashes:
+            self.refs[content_hash] -= 1
+            if self.refs[content_hash] <= 0:
+                del self.refs[content_hash]
+                self.summaries.pop(content_hash, None)
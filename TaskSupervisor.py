@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+from collections import defaultdict
+from functools import partial
+
+from loguru import logger
+
+import metrics
+
+
+class TaskSupervisor:
+    """
+    Owns the background tasks of one component (a Device or a Model instance).
+    Every task gets a unique id, belongs to an optional cancellation scope and is tracked until it
+    finishes, so tasks can't leak and their exceptions are always reported.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, max_concurrency: int | None = None, on_error=None):
+        """
+        Initializes the supervisor.
+
+        Args:
+            name: Name used as prefix for task names and metrics.
+            max_concurrency: Maximum number of tasks running at once, extra tasks wait for a slot.
+            on_error: Optional callback `on_error(task, exception)` invoked when a task fails.
+        """
+        self.name = name
+        self.tasks = {}  # task_id -> asyncio.Task
+        self.scopes = defaultdict(set)  # scope -> task ids
+        self.on_error = on_error
+        self.errors = []
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        metrics.register_gauge(f"tasks.{name}.live", self.count)
+
+    def spawn(self, coro, name: str, scope: str | None = None) -> asyncio.Task:
+        """Starts `coro` as a supervised task."""
+        task_id = next(self._ids)
+        task = asyncio.create_task(self._run(coro), name=f"{self.name}.{name}#{task_id}")
+        self.tasks[task_id] = task
+        if scope:
+            self.scopes[scope].add(task_id)
+        task.add_done_callback(partial(self._on_done, task_id, scope))
+        metrics.inc("tasks.spawned")
+        return task
+
+    async def _run(self, coro):
+        try:
+            if self._semaphore is None:
+                return await coro
+            async with self._semaphore:
+                return await coro
+        finally:
+            # no-op for a finished coroutine, avoids "never awaited" warnings when cancelled while queued
+            coro.close()
+
+    def _on_done(self, task_id: int, scope: str | None, task: asyncio.Task):
+        self.tasks.pop(task_id, None)
+        if scope:
+            scope_ids = self.scopes.get(scope)
+            if scope_ids is not None:
+                scope_ids.discard(task_id)
+                if not scope_ids:
+                    del self.scopes[scope]
+        if task.cancelled():
+            return
+        exception = task.exception()
+        if exception is None:
+            return
+        metrics.inc("tasks.failed")
+        self.errors.append(exception)
+        logger.opt(exception=exception).error(f"Task {task.get_name()} failed: {exception}")
+        if self.on_error:
+            self.on_error(task, exception)
+
+    def count(self, scope: str | None = None) -> int:
+        """Returns the number of live tasks, optionally restricted to a scope."""
+        if scope is None:
+            return len(self.tasks)
+        return len(self.scopes.get(scope, ()))
+
+    def _select(self, scope: str | None) -> list[asyncio.Task]:
+        ids = self.tasks.keys() if scope is None else self.scopes.get(scope, ())
+        current = asyncio.current_task()
+        return [self.tasks[task_id] for task_id in list(ids) if self.tasks[task_id] is not current]
+
+    async def cancel(self, scope: str | None = None):
+        """Cancels the tasks of a scope (all tasks if None) and waits for them to finish."""
+        tasks = self._select(scope)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def join(self, scope: str | None = None):
+        """Waits for the tasks of a scope (all tasks if None) and those they spawn, re-raising the first failure."""
+        while tasks := self._select(scope):
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+    async def close(self):
+        await self.cancel()
+        metrics.unregister_gauge(f"tasks.{self.name}.live")
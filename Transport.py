@@ -0,0 +1,200 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+from loguru import logger
+
+from TaskSupervisor import TaskSupervisor
+
+
+def _name(name) -> str:
+    # accepts MessageName members as well as raw message names
+    return getattr(name, "value", name)
+
+
+class Transport(ABC):
+    """
+    Duplex frame channel between the Device and the ECU.
+
+    A transport sends serialized frames with `send`, yields received frames by async iteration until the peer
+    goes away, and reports whether it can still send through `closed`.
+    """
+
+    @abstractmethod
+    async def send(self, data: str):
+        ...
+
+    def __aiter__(self):
+        return self
+
+    @abstractmethod
+    async def __anext__(self) -> str:
+        ...
+
+    @property
+    @abstractmethod
+    def closed(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+
+class WebSocketTransport(Transport):
+    """Transport over a `websockets` client connection."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self._messages = ws.__aiter__()  # ends on a clean close, raises on an abnormal one
+
+    async def send(self, data: str):
+        await self.ws.send(data)
+
+    async def __anext__(self) -> str:
+        return await self._messages.__anext__()
+
+    @property
+    def closed(self) -> bool:
+        closed = getattr(self.ws, "closed", None)
+        if closed is None:  # websockets >= 14 connections expose their state instead of `closed`
+            return self.ws.state.name != "OPEN"
+        return closed
+
+    async def close(self):
+        await self.ws.close()
+
+
+class LoopbackTransport(Transport):
+    """One end of an in-memory duplex channel, see `loopback_pair()`."""
+
+    def __init__(self):
+        self.peer = None
+        self.inbox = deque()
+        self._waiter = None
+        self._closed = False
+
+    async def send(self, data: str):
+        if self._closed:
+            raise ConnectionError("Loopback transport is closed")
+        self.peer._deliver(data)
+
+    def _deliver(self, data: str | None):
+        # None marks the end of the stream
+        self.inbox.append(data)
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def __anext__(self) -> str:
+        while not self.inbox:
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+            self._waiter = None
+        data = self.inbox.popleft()
+        if data is None:
+            self._closed = True
+            raise StopAsyncIteration
+        return data
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._deliver(None)
+        self.peer._closed = True
+        self.peer._deliver(None)
+
+
+def loopback_pair() -> tuple[LoopbackTransport, LoopbackTransport]:
+    """Creates the two connected ends of an in-memory channel: what one end sends, the other receives."""
+    a, b = LoopbackTransport(), LoopbackTransport()
+    a.peer, b.peer = b, a
+    return a, b
+
+
+class FakeEcu:
+    """
+    Programmable ECU on the far end of a transport.
+
+    Sends protocol frames, records the frames received from the Device and can answer them automatically:
+    `on(name, handler)` registers a responder called with every received message of that name, whose returned
+    frames (dicts) are sent back. `expect()` waits for a matching frame and reports how long it took.
+    """
+
+    def __init__(self, transport: Transport, record: bool = True):
+        """
+        Initializes the fake ECU.
+
+        Args:
+            transport: ECU end of the channel.
+            record: Whether to keep every received message in `received`, disable it for long runs.
+        """
+        self.transport = transport
+        self.record = record
+        self.received = []
+        self.counts = {}  # message name -> number of frames received
+        self.responders = {}
+        self._expectations = []
+        self.tasks = TaskSupervisor("fake_ecu")
+
+    def start(self):
+        self.tasks.spawn(self._receive(), "fake_ecu_receive")
+
+    async def stop(self):
+        await self.transport.close()
+        await self.tasks.close()
+
+    def on(self, name: str, handler):
+        """Registers `handler(message) -> list[dict] | None` for the received messages named `name`."""
+        self.responders[_name(name)] = handler
+
+    async def send(self, name: str, instance: int = -1, type: str = "method_void", **fields):
+        await self.transport.send(json.dumps({"name": _name(name), "type": type, "instance": instance, **fields}))
+
+    async def send_raw(self, frame: str):
+        await self.transport.send(frame)
+
+    async def expect(self, name: str, predicate=None, timeout: float = 5.0) -> tuple[dict, float]:
+        """
+        Waits for the next received message named `name` (and matching `predicate(message)` if given).
+
+        Returns:
+            The message and the time waited in seconds.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._expectations.append((_name(name), predicate, future))
+        start = time.perf_counter()
+        message = await asyncio.wait_for(future, timeout)
+        return message, time.perf_counter() - start
+
+    async def _receive(self):
+        async for frame in self.transport:
+            message = json.loads(frame.rstrip("\n\x00"))
+            name = message.get("name")
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if self.record:
+                self.received.append(message)
+            self._match(name, message)
+            handler = self.responders.get(name)
+            if handler:
+                for reply in handler(message) or ():
+                    await self.transport.send(json.dumps(reply))
+        logger.debug("Fake ECU transport closed")
+
+    def _match(self, name: str, message: dict):
+        if not self._expectations:
+            return
+        # drop the expectations that timed out
+        self._expectations = [expectation for expectation in self._expectations if not expectation[2].done()]
+        for expectation in self._expectations:
+            expected_name, predicate, future = expectation
+            if expected_name == name and (predicate is None or predicate(message)):
+                self._expectations.remove(expectation)
+                future.set_result(message)
+                return
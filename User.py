@@ -1,11 +1,97 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
-# @dataclass
+from loguru import logger
+
+import constants as c
+
+INTEREST_BITS = {interest: 1 << i for i, interest in enumerate(c.INTERESTS)}
+
+
+def parse_interests(value: str) -> int:
+    """Parses a "art_and_culture|geography|..." string into a bitset over `constants.INTERESTS`."""
+    mask = 0
+    for interest in value.split("|"):
+        interest = interest.strip()
+        bit = INTEREST_BITS.get(interest)
+        if bit is None:
+            if interest:
+                logger.warning(f"Unknown interest: {interest}")
+            continue
+        mask |= bit
+    return mask
+
+
+@dataclass(slots=True)
 class User:
-    def __init__(self):
-        pass  # Initialization logic, if needed
+    name: str = ""
+    age: int | None = None
+    gender: str = ""
+    interests: int = 0  # bitset over constants.INTERESTS
+
+    def has_interest(self, mask: int) -> bool:
+        return bool(self.interests & mask)
 
     def __str__(self):
         s = ""
-        for key, value in self.__dict__.items():
-            s += f"{key}: {value}\n"
+        for field in fields(self):
+            s += f"{field.name}: {getattr(self, field.name)}\n"
+        return s
+
+
+class UserStore:
+    """
+    Typed user profiles keyed by instance id.
+    USER_DETECTED fields are converted once on arrival and applied as a diff on the existing profile.
+    """
+
+    def __init__(self):
+        self.users = {}  # instance_id -> User
+
+    @staticmethod
+    def _convert(fields: dict) -> dict:
+        values = {}
+        for name, value in fields.items():
+            if name == "interest":
+                values["interests"] = parse_interests(value or "")
+            elif name == "age":
+                try:
+                    values["age"] = int(value)
+                except (TypeError, ValueError):
+                    logger.warning(f"Invalid user age: {value}")
+            elif name in ("name", "gender"):
+                values[name] = value
+            else:
+                logger.debug(f"Ignoring unknown user field: {name}")
+        return values
+
+    def update(self, instance_id: int, fields: dict) -> dict:
+        """
+        Applies USER_DETECTED fields to the profile of an instance.
+
+        Returns:
+            The changed fields with their new values, empty if nothing changed.
+        """
+        user = self.users.get(instance_id)
+        if user is None:
+            user = self.users[instance_id] = User()
+        diff = {}
+        for name, value in self._convert(fields).items():
+            if getattr(user, name) != value:
+                setattr(user, name, value)
+                diff[name] = value
+        return diff
+
+    def get(self, instance_id: int) -> User | None:
+        return self.users.get(instance_id)
+
+    def put(self, instance_id: int, user: User):
+        self.users[instance_id] = user
+
+    def clear(self):
+        self.users = {}
+
+    def __contains__(self, instance_id: int) -> bool:
+        return instance_id in self.users
+
+    def __len__(self) -> int:
+        return len(self.users)
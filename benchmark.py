@@ -0,0 +1,1025 @@
+"""
+Local performance benchmarks for the agent.
+
+Usage:
+    python benchmark.py                  # run every benchmark
+    python benchmark.py email_sync       # run selected benchmarks
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --threshold 10
+
+Metrics named `*_ns`, `*_us`, `*_ms` and `*_s` are lower-is-better, `*_per_s` higher-is-better. They are the
+ones compared against a baseline, a regression is a metric worse than its baseline by more than the threshold.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from loguru import logger
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, micro: bool = False):
+    """
+    Registers a benchmark coroutine under the given name.
+    Micro-benchmarks time tight synchronous loops, they run without the loop watchdog.
+    """
+    def decorator(func):
+        func.micro = micro
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def _email_fields(i: int) -> list[dict]:
+    return [
+        {"name": "predefined", "value": "true"},
+        {"name": "sender_name", "value": f"Customer {i}"},
+        {"name": "sender_email_address", "value": f"customer_{i}@anywhere.com"},
+        {"name": "date", "value": "02-04-2024"},
+        {"name": "time", "value": f"{i // 60 % 24:02d}:{i % 60:02d}"},
+        {"name": "kind", "value": "urgent" if i % 3 == 0 else "normal"},
+        {"name": "unread", "value": "true"},
+        {"name": "object", "value": f"Subject {i}"},
+        {"name": "content", "value": f"Body of email number {i}. " * 8},
+    ]
+
+
+class NullWebSocket:
+    """Websocket stand-in that swallows outbound frames, optionally passing them to `on_send`."""
+
+    closed = False
+
+    def __init__(self, on_send=None):
+        self.sent = 0
+        self.on_send = on_send
+
+    async def send(self, data):
+        self.sent += 1
+        if self.on_send:
+            self.on_send(data)
+
+
+class ScriptedListener:
+    """Listener stand-in that answers immediately with a canned transcript instead of reading the terminal."""
+
+    transcript = "hello"
+
+    def __init__(self):
+        self.stop_event = asyncio.Event()
+
+    async def start(self):
+        await asyncio.sleep(0)
+        return self.transcript
+
+    async def stop(self):
+        self.stop_event.set()
+
+
+def _time_per_op(func, number: int, repeat: int) -> float:
+    """Best-of-`repeat` time of `number` calls of `func`, in nanoseconds per call."""
+    return min(timeit.Timer(func).repeat(repeat, number)) / number * 1e9
+
+
+async def _atime_per_op(make_call, number: int, repeat: int) -> float:
+    """Like `_time_per_op` for coroutines, `make_call(i)` returns the i-th coroutine (i runs on across repeats)."""
+    best = float("inf")
+    gc.disable()
+    try:
+        for r in range(repeat):
+            start = time.perf_counter()
+            for i in range(r * number, (r + 1) * number):
+                await make_call(i)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best / number * 1e9
+
+
+def _frame(name: str, instance: int, **fields) -> str:
+    return json.dumps({"name": name, "instance": instance, **fields})
+
+
+async def _wait_until(predicate, timeout: float = 5.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+@benchmark("email_sync")
+async def bench_email_sync(args) -> dict:
+    """Time to ingest and process a mailbox pushed one frame per email vs. one batched frame."""
+    from Device import Device
+
+    def build_frames() -> tuple[list, list]:
+        single = [json.dumps({"name": "service_add_email", "type": "method_struct", "instance": -1,
+                              "fields": _email_fields(i)}) for i in range(args.emails)]
+        batched = [json.dumps({"name": "service_add_emails", "type": "method_struct_array", "instance": -1,
+                               "emails": [_email_fields(i) for i in range(args.emails)]})]
+        return single, batched
+
+    # built off the event loop, the loop lag measures the agent only
+    single, batched = await asyncio.get_running_loop().run_in_executor(None, build_frames)
+    mail_end = json.dumps({"name": "service_predefined_mail_transaction_finished", "type": "method_void",
+                           "instance": -1})
+
+    results = {"emails": args.emails}
+    for mode, frames in (("single", single), ("batch", batched)):
+        with tempfile.TemporaryDirectory() as tmp:
+            device = Device(url="", email_store_path=os.path.join(tmp, "emails.sqlite3"))
+            start = time.perf_counter()
+            for frame in frames:
+                await device.handle_ecu_message(frame)
+                await asyncio.sleep(0)  # frames arrive one by one from the transport
+            await device.handle_ecu_message(mail_end)
+            await device.tasks.join()
+            results[f"{mode}_s"] = round(time.perf_counter() - start, 4)
+            device.em.store.close()
+    results["speedup"] = round(results["single_s"] / results["batch_s"], 2)
+    return results
+
+
+@benchmark("task_soak")
+async def bench_task_soak(args) -> dict:
+    """
+    Repeated cycles of listener enable / dialog turns / disable and of email readouts, where every TTS_COMPLETED
+    restarts the chat loop and the user never says next or stop. The number of live tasks must stay flat.
+    """
+    import metrics
+    from Device import Device
+    from model import Model
+
+    Model.listener_cls = ScriptedListener
+    device = Device(url="", email_store_path=None)
+    device.ws = NullWebSocket()
+    await device.handle_ecu_message(_frame("zone_1", 1, type="instance_add", value="1"))
+    model = device.models[1]
+    # not urgent emails only, the readout starts right away without asking which emails to read first
+    await device.handle_ecu_message(_frame("service_add_emails", -1, emails=[_email_fields(i) for i in (1, 2)]))
+    await device.handle_ecu_message(_frame("service_predefined_mail_transaction_finished", -1))
+    await device.tasks.join()
+
+    live = []
+    chat_loops_max = 0
+    start = time.perf_counter()
+    for _ in range(args.cycles):
+        await device.handle_ecu_message(_frame("service_enable_listener", 1, value="true"))
+        for _ in range(3):
+            await _wait_until(lambda: not model.tts_completed)
+            await device.handle_ecu_message(_frame("service_tts_completed", 1))
+        await device.handle_ecu_message(_frame("service_enable_listener", 1, value="false"))
+        await _wait_until(lambda: model.tasks.count() == 0)
+
+        await device.handle_ecu_message(_frame("service_agent_feature", 1, value="email"))
+        while device.agent_feature != "dialog":
+            await _wait_until(lambda: not model.tts_completed or device.agent_feature == "dialog")
+            if device.agent_feature == "dialog":
+                break
+            await device.handle_ecu_message(_frame("service_tts_completed", 1))
+            chat_loops_max = max(chat_loops_max, model.tasks.count("chat"))
+        await _wait_until(lambda: model.tasks.count() == 0)
+        live.append(len(asyncio.all_tasks()))
+    elapsed = time.perf_counter() - start
+
+    counters = metrics.snapshot()["counters"]
+    return {
+        "cycles": args.cycles,
+        "elapsed_s": round(elapsed, 3),
+        "live_tasks_first": live[0],
+        "live_tasks_last": live[-1],
+        "live_tasks_max": max(live),
+        "chat_loops_max": chat_loops_max,
+        "passed": max(live) <= live[0] and chat_loops_max <= 1,
+        "tasks_spawned": counters.get("tasks.spawned", 0),
+        "tasks_failed": counters.get("tasks.failed", 0),
+    }
+
+
+@benchmark("sharding")
+async def bench_sharding(args) -> dict:
+    """
+    Zone throughput through ecu_simulation's websocket server, in-process vs. sharded across worker processes.
+    The simulator adds `--instances` zones, each answered with DEVICE_READY by the Model owning it.
+    """
+    import websockets
+    import ecu_simulation
+    from Device import Device
+
+    ready = [0]
+
+    def count_ready(message):
+        if "service_device_is_ready" in message:
+            ready[0] += 1
+
+    ecu_simulation.message_hooks.append(count_ready)
+    results = {"instances": args.instances}
+    try:
+        for shards in sorted({0, *args.shards}):
+            server = await websockets.serve(ecu_simulation.handler, "localhost", 0)
+            port = server.sockets[0].getsockname()[1]
+            device = Device(url=f"ws://localhost:{port}", email_store_path=None, shards=shards)
+            if device.router:
+                device.router.log_level = args.log_level
+            ready[0] = 0
+            agent = asyncio.create_task(device.start())
+            await _wait_until(lambda: ready[0] >= 4, timeout=60)  # zones added by ecu_simulation.prepare
+
+            start = time.perf_counter()
+            for instance_id in range(100, 100 + args.instances):
+                await ecu_simulation.broadcast(json.dumps({"type": "instance_add", "instance": instance_id,
+                                                           "name": f"zone_{instance_id}", "value": instance_id}))
+            await _wait_until(lambda: ready[0] >= 4 + args.instances, timeout=120)
+            elapsed = time.perf_counter() - start
+            results[f"shards_{shards}"] = {"elapsed_s": round(elapsed, 4),
+                                           "instances_per_s": round(args.instances / elapsed, 1)}
+
+            await device.ws.close()
+            await asyncio.gather(agent, return_exceptions=True)
+            if device.router:
+                await device.router.stop()
+            server.close()
+            await server.wait_closed()
+    finally:
+        ecu_simulation.message_hooks.remove(count_ready)
+    return results
+
+
+@benchmark("barge_in")
+async def bench_barge_in(args) -> dict:
+    """Latency from a USER_SPEECH frame arriving mid-response to the LISTENING dialog state leaving the agent."""
+    from Device import Device
+    from model import Model
+
+    listening_at = []
+
+    def on_send(data):
+        if '"service_dialog_state"' in data and '"listening"' in data:
+            listening_at.append(time.perf_counter())
+
+    Model.listener_cls = ScriptedListener
+    device = Device(url="", email_store_path=None)
+    device.ws = NullWebSocket(on_send)
+    await device.handle_ecu_message(_frame("zone_1", 1, type="instance_add", value="1"))
+    model = device.models[1]
+    await device.handle_ecu_message(_frame("service_enable_listener", 1, value="true"))
+
+    latencies = []
+    speech = _frame("service_user_speech_detected", 1)
+    for _ in range(args.turns):
+        await _wait_until(lambda: not model.tts_completed)
+        listening_at.clear()
+        start = time.perf_counter()
+        await device.handle_ecu_message(speech)
+        latencies.append((listening_at[0] - start) * 1000)
+    await device.handle_ecu_message(_frame("service_enable_listener", 1, value="false"))
+
+    latencies.sort()
+    return {
+        "turns": args.turns,
+        "p50_ms": round(latencies[len(latencies) // 2], 4),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)], 4),
+        "max_ms": round(latencies[-1], 4),
+    }
+
+
+@benchmark("turn_gap")
+async def bench_turn_gap(args) -> dict:
+    """Gap between TTS_COMPLETED reaching the agent and the next LISTENING dialog state leaving it."""
+    from Device import Device
+    from model import Model
+
+    listening_at = []
+
+    def on_send(data):
+        if '"service_dialog_state"' in data and '"listening"' in data:
+            listening_at.append(time.perf_counter())
+
+    Model.listener_cls = ScriptedListener
+    device = Device(url="", email_store_path=None)
+    device.ws = NullWebSocket(on_send)
+    await device.handle_ecu_message(_frame("zone_1", 1, type="instance_add", value="1"))
+    model = device.models[1]
+    await device.handle_ecu_message(_frame("service_enable_listener", 1, value="true"))
+
+    gaps = []
+    tts_completed = _frame("service_tts_completed", 1)
+    for _ in range(args.turns):
+        await _wait_until(lambda: not model.tts_completed)
+        listening_at.clear()
+        start = time.perf_counter()
+        await device.handle_ecu_message(tts_completed)
+        await _wait_until(lambda: listening_at)
+        gaps.append((listening_at[0] - start) * 1000)
+    await device.handle_ecu_message(_frame("service_enable_listener", 1, value="false"))
+
+    gaps.sort()
+    return {
+        "turns": args.turns,
+        "p50_ms": round(gaps[len(gaps) // 2], 4),
+        "p99_ms": round(gaps[int(len(gaps) * 0.99)], 4),
+        "max_ms": round(gaps[-1], 4),
+    }
+
+
+@benchmark("speech_arbitration")
+async def bench_speech_arbitration(args) -> dict:
+    """
+    Four zones talking at once through the cabin speech scheduler, one urgent email every tenth utterance.
+    The fake ECU completes each utterance after `--playback-ms`. Reports queue wait per priority class.
+    """
+    import metrics
+    from Device import Device
+    from enums import SpeechPriority
+
+    metrics.reset()
+    device = Device(url="", email_store_path=None)
+    loop = asyncio.get_running_loop()
+
+    def on_send(data):
+        if '"service_tts_text"' in data:
+            instance_id = json.loads(data.rstrip("\0"))["instance"]
+            loop.call_later(args.playback_ms / 1000, lambda: loop.create_task(
+                device.handle_ecu_message(_frame("service_tts_completed", instance_id))))
+
+    device.ws = NullWebSocket(on_send)
+    for instance_id in range(1, 5):
+        await device.handle_ecu_message(_frame(f"zone_{instance_id}", instance_id, type="instance_add",
+                                               value=str(instance_id)))
+
+    start = time.perf_counter()
+    for i in range(args.utterances):
+        priority = SpeechPriority.URGENT_EMAIL if i % 10 == 0 else SpeechPriority.DIALOG
+        await device.send_text(f"Utterance {i}", i % 4 + 1, priority)
+    await _wait_until(lambda: device.speech.current is None and not device.speech.pending(), timeout=120)
+    elapsed = time.perf_counter() - start
+
+    observations = metrics.snapshot()["observations"]
+    return {
+        "utterances": args.utterances,
+        "elapsed_s": round(elapsed, 3),
+        "preempted": metrics.snapshot()["counters"].get("tts.preempted", 0),
+        **{name.removeprefix("tts.queue_wait_ms."): {key: round(value, 3) for key, value in summary.items()}
+           for name, summary in observations.items() if name.startswith("tts.queue_wait_ms.")},
+    }
+
+
+@benchmark("loop_watchdog")
+async def bench_loop_watchdog(args) -> dict:
+    """
+    Overhead of the loop watchdog, and detection of a blocking call.
+
+    The watchdog costs one sampler wake-up on the loop and one check on its thread per interval. Their measured
+    cost over the interval is the overhead that must stay under `WATCHDOG_MAX_OVERHEAD_PCT`. Frame dispatch with and
+    without the watchdog is reported too, but a run-to-run swing of tens of percent hides a 1% difference.
+    """
+    from Device import Device
+    from LoopWatchdog import LoopWatchdog
+
+    device = Device(url="", email_store_path=None)
+    frame = _frame("service_user_detected", 1, fields=[{"name": "name", "value": "John"},
+                                                       {"name": "age", "value": "25"}])
+
+    async def dispatch() -> float:
+        start = time.perf_counter()
+        for i in range(args.frames):
+            await device.handle_ecu_message(frame)
+            if i % 100 == 0:
+                await asyncio.sleep(0)  # let the sampler run like a live loop would
+        return time.perf_counter() - start
+
+    # alternated runs (ABBA order), best of each
+    without = with_watchdog = float("inf")
+    watching = True
+    gc.disable()
+    try:
+        for round_ in range(WATCHDOG_ROUNDS):
+            for watched in ((False, True) if round_ % 2 else (True, False)):
+                if watched and not watching:
+                    args.watchdog.start()
+                elif watching and not watched:
+                    await args.watchdog.stop()
+                watching = watched
+                if watched:
+                    with_watchdog = min(with_watchdog, await dispatch())
+                else:
+                    without = min(without, await dispatch())
+        if not watching:
+            args.watchdog.start()
+    finally:
+        gc.enable()
+
+    # cost of one interval of the watchdog: the sampler wake-up (timer round trip and lag record) and the check
+    probe = LoopWatchdog(interval=args.watchdog.interval, threshold=args.watchdog.threshold)
+    wake_ns = await _atime_per_op(lambda i: asyncio.sleep(0), args.number, args.repeat)
+    beat_ns = _time_per_op(lambda: probe._beat(time.monotonic() - probe.interval), args.number, args.repeat)
+    check_ns = _time_per_op(probe._check, args.number, args.repeat)
+    overhead_pct = (wake_ns + beat_ns + check_ns) / (probe.interval * 1e9) * 100
+
+    def blocking_call():
+        time.sleep(args.watchdog.threshold * 3)
+
+    blocking_call()
+    await asyncio.sleep(args.watchdog.interval * 2)
+    return {
+        "frames": args.frames,
+        "without_s": round(without, 4),
+        "with_s": round(with_watchdog, 4),
+        "dispatch_overhead_pct": round((with_watchdog - without) / without * 100, 2),
+        "interval_cost_ns": round(wake_ns + beat_ns + check_ns, 1),
+        "overhead_pct": round(overhead_pct, 4),
+        "passed": (bool(args.watchdog.last_stack) and "blocking_call" in args.watchdog.last_stack
+                   and overhead_pct <= WATCHDOG_MAX_OVERHEAD_PCT),
+    }
+
+
+WATCHDOG_ROUNDS = 25
+WATCHDOG_MAX_OVERHEAD_PCT = 1.0
+
+
+@benchmark("loopback")
+async def bench_loopback(args) -> dict:
+    """Protocol throughput between the agent and a fake ECU over the in-memory transport, without sockets."""
+    from Device import Device
+    from Transport import FakeEcu, loopback_pair
+    from enums import DialogState, MessageName
+    from model import Model
+
+    Model.listener_cls = ScriptedListener
+    device_end, ecu_end = loopback_pair()
+    device = Device(url="", email_store_path=None)
+    ecu = FakeEcu(ecu_end, record=False)
+    ecu.start()
+    session = asyncio.create_task(device.serve(device_end))
+    await ecu.send("zone_1", 1, type="instance_add", value="1")
+    await ecu.expect(MessageName.DEVICE_READY)
+    results = {"frames": args.loopback_frames}
+
+    # inbound: ECU frames parsed and dispatched by the agent
+    frame = _frame("service_next_email", 1)
+    start = time.perf_counter()
+    for i in range(args.loopback_frames):
+        await ecu.send_raw(frame)
+        if i % 1000 == 0:
+            await asyncio.sleep(0)  # let the agent drain its inbox like a live loop would
+    await _wait_until(lambda: not device_end.inbox, timeout=600)
+    results["inbound_frames_per_s"] = round(args.loopback_frames / (time.perf_counter() - start))
+
+    # outbound: dialog states serialized and sent by the agent
+    received = ecu.counts.get(MessageName.DIALOG_STATE.value, 0)
+    start = time.perf_counter()
+    for i in range(args.loopback_frames):
+        await device.send_dialog_state(DialogState.LISTENING, 1)
+        if i % 1000 == 0:
+            await asyncio.sleep(0)
+    await _wait_until(lambda: ecu.counts.get(MessageName.DIALOG_STATE.value, 0) - received >= args.loopback_frames,
+                      timeout=600)
+    results["outbound_frames_per_s"] = round(args.loopback_frames / (time.perf_counter() - start))
+
+    # round trip: barge-in frame in, LISTENING dialog state out
+    await ecu.send("service_enable_listener", 1, type="object_write", value="true")
+    latencies = []
+    for _ in range(args.turns):
+        await _wait_until(lambda: not device.models[1].tts_completed)
+        expected = ecu.expect(MessageName.DIALOG_STATE, lambda message: message["value"] == "listening")
+        waiter = asyncio.ensure_future(expected)
+        await asyncio.sleep(0)  # register the expectation before the frame goes out
+        await ecu.send("service_user_speech_detected", 1)
+        latencies.append((await waiter)[1] * 1000)
+    await ecu.send("service_enable_listener", 1, type="object_write", value="false")
+    await _wait_until(lambda: not device.models[1].chat_enabled)
+    latencies.sort()
+    results["round_trip_p50_ms"] = round(latencies[len(latencies) // 2], 4)
+    results["round_trip_p99_ms"] = round(latencies[int(len(latencies) * 0.99)], 4)
+
+    await ecu.stop()
+    await asyncio.gather(session, return_exceptions=True)
+    return results
+
+
+@benchmark("classify_urgency", micro=True)
+async def bench_classify_urgency(args) -> dict:
+    """`helpers.classify_urgency` on a mix of urgent, negated and unrelated answers."""
+    from helpers import classify_urgency
+
+    answers = ["Urgent emails please", "the not urgent ones", "less important first",
+               "hmm, read me the critical ones", "I don't know, whatever you prefer"]
+
+    def classify_all():
+        for answer in answers:
+            classify_urgency(answer)
+
+    return {"calls": args.number * len(answers),
+            "per_call_ns": round(_time_per_op(classify_all, args.number, args.repeat) / len(answers), 1)}
+
+
+@benchmark("parse_frame", micro=True)
+async def bench_parse_frame(args) -> dict:
+    """`Device.handle_ecu_message` parsing and dispatch, per frame kind."""
+    from Device import Device
+
+    device = Device(url="", email_store_path=None)
+    user = _frame("service_user_detected", 1, fields=[{"name": "name", "value": "John"},
+                                                      {"name": "age", "value": "25"}])
+    kinds = {
+        "small": lambda i: _frame("service_next_email", 1),
+        "user_detected": lambda i: user,
+        "email_add": lambda i: json.dumps({"name": "service_add_email", "type": "method_struct", "instance": -1,
+                                           "fields": _email_fields(i)}),
+    }
+    results = {"frames": args.number}
+    for kind, make_frame in kinds.items():
+        frames = [make_frame(i) for i in range(args.number * args.repeat)]  # every email frame adds a new email
+        results[f"{kind}_ns"] = round(await _atime_per_op(lambda i: device.handle_ecu_message(frames[i]),
+                                                          args.number, args.repeat), 1)
+    return results
+
+
+@benchmark("serialize", micro=True)
+async def bench_serialize(args) -> dict:
+    """`Device.send_message` serialization and send, per message kind."""
+    from Device import Device
+    from enums import DialogState, LogLevel
+
+    device = Device(url="", email_store_path=None)
+    device.ws = NullWebSocket()
+    calls = {
+        "dialog_state": lambda i: device.send_message({"name": "service_dialog_state", "type": "object_simple_signal",
+                                                       "instance": 1, "value": DialogState.LISTENING.value}),
+        "log": lambda i: device.send_log_message("Connection Opened", LogLevel.INFO),
+        "tts": lambda i: device.send_message(device._tts_message("From: Customer 1\n" + "Summary " * 12, 1)),
+    }
+    results = {"messages": args.number}
+    for kind, make_call in calls.items():
+        results[f"{kind}_ns"] = round(await _atime_per_op(make_call, args.number, args.repeat), 1)
+    return results
+
+
+@benchmark("email_manager", micro=True)
+async def bench_email_manager(args) -> dict:
+    """`EmailManager.add_email`, `process_emails` and `generate_report` at several mailbox sizes."""
+    from EmailManager import Email, EmailManager
+    from enums import EmailClass
+
+    results = {}
+    for size in args.sizes:
+        emails = []
+        for i in range(size):
+            fields = {field["name"]: field["value"] for field in _email_fields(i)}
+            emails.append(Email(fields["sender_name"], fields["object"], fields["content"], fields["kind"],
+                                fields["sender_email_address"], fields["date"], fields["time"]))
+        add_s = process_s = warm_s = float("inf")
+        for _ in range(args.repeat):
+            em = EmailManager()
+            start = time.perf_counter()
+            for email in emails:
+                em.add_email(*email)
+            add_s = min(add_s, time.perf_counter() - start)
+            start = time.perf_counter()
+            await em.process_emails()  # cold: every summary is computed
+            process_s = min(process_s, time.perf_counter() - start)
+            start = time.perf_counter()
+            await em.process_emails()  # warm: summaries come from the cache
+            warm_s = min(warm_s, time.perf_counter() - start)
+        report_ns = await _atime_per_op(lambda i: em.generate_report(EmailClass.URGENT), 100, args.repeat)
+        results[str(size)] = {
+            "add_email_ns": round(add_s / size * 1e9, 1),
+            "process_cold_ms": round(process_s * 1000, 4),
+            "process_warm_ms": round(warm_s * 1000, 4),
+            "generate_report_us": round(report_ns / 1000, 3),
+        }
+    return results
+
+
+def _noisy_mailbox(size: int) -> list:
+    """Mailbox where a third of the emails are replies and a third repeat the same notification."""
+    from EmailManager import Email
+
+    emails = []
+    for i in range(size):
+        j = i // 3
+        if i % 3 == 0:
+            emails.append(Email(f"Customer {j}", f"Project {j}",
+                                f"Status of project {j}: milestone {j} is due next week and the budget of {j * 7} "
+                                f"euros was approved by the board", "urgent" if j % 4 == 0 else "normal",
+                                f"customer_{j}@anywhere.com", "02-04-2024", f"{j % 24:02d}:00"))
+        elif i % 3 == 1:
+            emails.append(Email(f"Customer {j}", f"RE: Project {j}", "Thanks, noted. I will update the plan.",
+                                "normal", f"customer_{j}@anywhere.com", "02-04-2024", f"{j % 24:02d}:30"))
+        else:
+            emails.append(Email("Security", f"Security digest #{j}",
+                                "New sign-ins were detected on your account this week, review them in the security "
+                                "settings if you do not recognize them", "normal", f"noreply_{j % 5}@anywhere.com",
+                                "02-04-2024", f"{j % 24:02d}:45"))
+    return emails
+
+
+@benchmark("email_threads")
+async def bench_email_threads(args) -> dict:
+    """Readout of a noisy mailbox (replies, repeated notifications) grouped into threads vs. one message per email."""
+    from EmailManager import EmailManager
+    from enums import EmailClass
+
+    emails = _noisy_mailbox(args.emails)
+    em = EmailManager()
+    start = time.perf_counter()
+    em.add_emails(emails)
+    ingest_s = time.perf_counter() - start
+    start = time.perf_counter()
+    await em.process_emails()
+    process_s = time.perf_counter() - start
+    await em.generate_report(EmailClass.URGENT)
+    readout = list(em.report_msgs)
+
+    ungrouped = [f"From: {email.sender}\n{em._get_email_summary(email.subject, email.body, email.sender)}"
+                 for email in emails]
+    return {
+        "emails": len(emails),
+        "threads": len(em.threads),
+        "summaries": len(em.summaries),
+        "report_messages": len(readout),
+        "ungrouped_report_messages": len(ungrouped) + 2,  # plus the urgent and less urgent headers
+        "readout_chars": sum(map(len, readout)),
+        "ungrouped_readout_chars": sum(map(len, ungrouped)),
+        "ingest_ms": round(ingest_s * 1000, 2),
+        "process_ms": round(process_s * 1000, 2),
+    }
+
+
+@benchmark("set_state", micro=True)
+async def bench_set_state(args) -> dict:
+    """`Model._set_state` churn between dialog states, each transition sending a state frame."""
+    from Device import Device
+    from enums import DialogState
+
+    device = Device(url="", email_store_path=None)
+    device.ws = NullWebSocket()
+    await device.handle_ecu_message(_frame("zone_1", 1, type="instance_add", value="1"))
+    model = device.models[1]
+    states = [DialogState.LISTENING, DialogState.PROCESSING, DialogState.RESPONDING, DialogState.IDLE]
+    transition_ns = await _atime_per_op(lambda i: model._set_state(states[i % len(states)]), args.number, args.repeat)
+    unchanged_ns = await _atime_per_op(lambda i: model._set_state(DialogState.IDLE), args.number, args.repeat)
+    return {"transitions": args.number, "transition_ns": round(transition_ns, 1),
+            "unchanged_ns": round(unchanged_ns, 1)}
+
+
+def _comparable(results: dict, prefix: str = "") -> dict:
+    """Flattens the results into {dotted.path: (value, higher_is_better)} for the metrics with a known direction."""
+    comparable = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            comparable.update(_comparable(value, f"{path}."))
+        elif (isinstance(value, (int, float)) and not isinstance(value, bool) and key not in NOT_COMPARED
+              and not TAIL_PARTS.intersection(key.split("_"))):
+            if key.endswith("_per_s"):
+                comparable[path] = (value, True)
+            elif key.endswith(("_ns", "_us", "_ms", "_s")):
+                comparable[path] = (value, False)
+    return comparable
+
+
+NOT_COMPARED = {"loop_lag_max_ms"}  # scheduling noise, reported for information only
+# single-run tail latencies of the macro-benchmarks swing by tens of percent between identical runs
+TAIL_PARTS = {"p99", "max"}
+
+
+def compare(results: dict, baseline: dict, threshold: float, macro_threshold: float) -> list[dict]:
+    """
+    Returns the metrics worse than their baseline by more than their threshold in percent: `threshold` for the
+    best-of-N micro-benchmarks, `macro_threshold` for the wall-clock benchmarks, whose runs are much noisier.
+    """
+    regressions = []
+    current = _comparable(results)
+    for path, (base, higher_is_better) in _comparable(baseline).items():
+        if path not in current or not base:
+            continue
+        name = path.split(".", 1)[0]
+        limit = threshold if name in BENCHMARKS and BENCHMARKS[name].micro else macro_threshold
+        value = current[path][0]
+        change = (value - base) / base * 100
+        worse = -change if higher_is_better else change
+        if worse > limit:
+            regressions.append({"metric": path, "baseline": base, "value": value, "change_pct": round(change, 2)})
+    return regressions
+
+
+@benchmark("warm_restart")
+async def bench_warm_restart(args) -> dict:
+    """Time to ready after a restart: ECU replay of a session vs. restore from the state snapshot."""
+    from Device import Device
+    from Transport import FakeEcu, loopback_pair
+    from enums import AgentFeature, MessageName
+    from model import Model
+
+    Model.listener_cls = ScriptedListener
+    zones = range(1, 5)
+    user = [{"name": "name", "value": "John"}, {"name": "age", "value": "25"},
+            {"name": "interest", "value": "history|geography"}]
+
+    async def connect(device: Device) -> FakeEcu:
+        device_end, ecu_end = loopback_pair()
+        ecu = FakeEcu(ecu_end, record=False)
+        ecu.start()
+        device.tasks.spawn(device.serve(device_end), "serve")
+        return ecu
+
+    async def replay(ecu: FakeEcu, size: int):
+        for zone in zones:
+            await ecu.send(f"zone_{zone}", zone, type="instance_add", value=str(zone))
+        for zone in zones:
+            await ecu.send(MessageName.USER_DETECTED, zone, type="object_struct_write", fields=user)
+        await ecu.send(MessageName.EMAILS_ADD, type="method_struct_array", emails=[_email_fields(i) for i in range(size)])
+        await ecu.send(MessageName.MAIL_END)
+
+    results = {}
+    for size in args.snapshot_sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            email_store_path = os.path.join(tmp, "emails.sqlite3")
+            snapshot_path = os.path.join(tmp, "state.sqlite3")
+
+            # cold start: the ECU replays zones, users and the whole mailbox, the dialog context is lost
+            start = time.perf_counter()
+            device = Device(url="", email_store_path=email_store_path, snapshot_path=snapshot_path)
+            await device.restore_snapshot()  # empty on the first run
+            ecu = await connect(device)
+            await replay(ecu, size)
+            await _wait_until(lambda: ecu.counts.get(MessageName.DEVICE_READY.value, 0) >= len(zones)
+                              and device.em.step == 0, timeout=120)
+            cold_ms = (time.perf_counter() - start) * 1000
+
+            for zone in zones:
+                device.models[zone].context = [f"Turn {i} of zone {zone}" for i in range(size)]
+            # snapshot taken in the middle of the email readout
+            device.agent_feature = AgentFeature.WORK.value
+            device.em.step = 2
+            start = time.perf_counter()
+            await device.save_snapshot()
+            full_write_ms = (time.perf_counter() - start) * 1000
+            device.models[1].context.append("One more turn")
+            start = time.perf_counter()
+            written = await device.save_snapshot()
+            incremental_write_ms = (time.perf_counter() - start) * 1000
+            await ecu.stop()
+            await device.tasks.close()
+            device.em.store.close()
+            device.snapshot.close()
+
+            # warm start: state restored before the ECU connects, nothing is replayed
+            start = time.perf_counter()
+            device = Device(url="", email_store_path=email_store_path, snapshot_path=snapshot_path)
+            await device.restore_snapshot()
+            ecu = await connect(device)
+            await _wait_until(lambda: ecu.counts.get(MessageName.DEVICE_READY.value, 0) >= len(zones), timeout=120)
+            warm_ms = (time.perf_counter() - start) * 1000
+            await device.mailbox_ready.wait()
+            mailbox_ms = (time.perf_counter() - start) * 1000
+            # the readout resumes on top of the DIALOG feature sent on connection, and goes on at the next TTS end
+            await _wait_until(lambda: ecu.counts.get(MessageName.AGENT_FEATURE.value, 0) >= 2, timeout=10)
+            restored = (len(device.models[1].context) == size + 1 and device.em.step == 2
+                        and device.agent_feature == AgentFeature.WORK.value)
+            await ecu.send(MessageName.TTS_COMPLETED, 1)
+            await _wait_until(lambda: device.models[1].chat_enabled, timeout=10)
+            await device.models[1].disable_chat()
+            await ecu.stop()
+            await device.tasks.close()
+            device.em.store.close()
+            device.snapshot.close()
+
+            results[str(size)] = {
+                "cold_ready_ms": round(cold_ms, 3),
+                "warm_ready_ms": round(warm_ms, 3),
+                "warm_mailbox_ms": round(mailbox_ms, 3),
+                "full_write_ms": round(full_write_ms, 3),
+                "incremental_write_ms": round(incremental_write_ms, 3),
+                "incremental_sections": written,
+                "snapshot_kb": round(os.path.getsize(snapshot_path) / 1024, 1),
+                "passed": restored,
+            }
+    results["passed"] = all(result["passed"] for result in results.values())
+    return results
+
+
+@benchmark("multi_ecu")
+async def bench_multi_ecu(args) -> dict:
+    """Memory per extra ECU served by one process, with and without sharing the immutable resources."""
+    import tracemalloc
+    from Device import Device
+    from SharedResources import SharedResources
+    from Transport import FakeEcu, loopback_pair
+    from enums import MessageName
+    from model import Model
+
+    Model.listener_cls = ScriptedListener
+    zones = range(1, 5)
+    user = [{"name": "name", "value": "John"}, {"name": "age", "value": "25"},
+            {"name": "interest", "value": "history|geography"}]
+    mailbox = json.dumps({"name": MessageName.EMAILS_ADD.value, "type": "method_struct_array", "instance": -1,
+                          "emails": [_email_fields(i) for i in range(args.ecu_emails)]})
+
+    async def add_ecu(shared, index: int) -> tuple:
+        device = Device(url="", email_store_path=None, shared=shared, name=f"bench_ecu_{index}")
+        device_end, ecu_end = loopback_pair()
+        ecu = FakeEcu(ecu_end, record=False)
+        ecu.start()
+        device.tasks.spawn(device.serve(device_end), "serve")
+        for zone in zones:
+            await ecu.send(f"zone_{zone}", zone, type="instance_add", value=str(zone))
+            await ecu.send(MessageName.USER_DETECTED, zone, type="object_struct_write", fields=user)
+        await ecu.send_raw(mailbox)
+        await ecu.send(MessageName.MAIL_END)
+        await _wait_until(lambda: ecu.counts.get(MessageName.DEVICE_READY.value, 0) >= len(zones)
+                          and device.em.step == 0 and len(device.content.cache.entries) >= len(zones), timeout=60)
+        return device, ecu
+
+    # warm-up connection, so that imports and process-wide caches (metrics windows, logger) are not counted
+    device, ecu = await add_ecu(None, -1)
+    await ecu.stop()
+    await device.tasks.close()
+
+    results = {"ecus": args.ecus, "emails_per_ecu": args.ecu_emails}
+    for mode in ("shared", "isolated"):
+        connections = []
+        tracemalloc.start()
+        shared = SharedResources() if mode == "shared" else None
+        connections.append(await add_ecu(shared, 0))
+        gc.collect()
+        first = tracemalloc.get_traced_memory()[0]
+        for index in range(1, args.ecus):
+            connections.append(await add_ecu(shared, index))
+        gc.collect()
+        total = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[mode] = {
+            "first_ecu_kb": round(first / 1024, 1),
+            "per_extra_ecu_kb": round((total - first) / max(args.ecus - 1, 1) / 1024, 1),
+        }
+        for device, ecu in connections:
+            await ecu.stop()
+            await device.tasks.close()
+    results["saved_per_extra_ecu_kb"] = round(results["isolated"]["per_extra_ecu_kb"]
+                                              - results["shared"]["per_extra_ecu_kb"], 1)
+    return results
+
+
+def _import_times(path: str) -> list[tuple[int, str, float]]:
+    """Parses `-X importtime` output into (depth, module, cumulative ms) for the imports done after `site`."""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            _, cumulative, name = line.rstrip("\n").split("|")
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            entries.append((depth, name.strip(), int(cumulative) / 1000))
+            if depth == 0 and name.strip() == "site":
+                entries = []  # interpreter startup, not the agent's
+    return entries
+
+
+@benchmark("startup")
+async def bench_startup(args) -> dict:
+    """Cold start of `main.py` under `-X importtime`: time from process start to DEVICE_READY of every zone."""
+    import websockets
+    import ecu_simulation
+
+    ready = [0]
+
+    def count_ready(message):
+        if "service_device_is_ready" in message:
+            ready[0] += 1
+
+    ecu_simulation.message_hooks.append(count_ready)
+    ready_ms, import_ms, imports = [], [], {}
+    try:
+        for _ in range(args.startup_runs):
+            server = await websockets.serve(ecu_simulation.handler, "localhost", 0)
+            ready[0] = 0
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {**os.environ, "AGENT_ECU_PORT": str(server.sockets[0].getsockname()[1]),
+                       "AGENT_CACHE_DIR": tmp, "AGENT_SNAPSHOT": ""}
+                stderr_path = os.path.join(tmp, "stderr.log")
+                with open(stderr_path, "w") as stderr:
+                    start = time.perf_counter()
+                    process = await asyncio.create_subprocess_exec(
+                        sys.executable, "-X", "importtime", "main.py", cwd=os.path.dirname(os.path.abspath(__file__)),
+                        env=env, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=stderr)
+                    await _wait_until(lambda: ready[0] >= 4, timeout=60)  # zones added by ecu_simulation.prepare
+                    ready_ms.append((time.perf_counter() - start) * 1000)
+                    process.terminate()
+                    await process.wait()
+                entries = _import_times(stderr_path)
+            import_ms.append(sum(cumulative for depth, _, cumulative in entries if depth == 0))
+            for depth, name, cumulative in entries:
+                if depth <= 1:
+                    imports[name] = min(cumulative, imports.get(name, cumulative))
+            server.close()
+            await server.wait_closed()
+    finally:
+        ecu_simulation.message_hooks.remove(count_ready)
+
+    ready_ms.sort()
+    return {
+        "runs": args.startup_runs,
+        "ready_min_ms": round(ready_ms[0], 2),
+        "ready_median_ms": round(ready_ms[len(ready_ms) // 2], 2),
+        "imports_min_ms": round(min(import_ms), 2),
+        "slowest_imports": [[name, round(ms, 2)] for name, ms in sorted(imports.items(), key=lambda item: -item[1])[:8]],
+    }
+
+
+async def run(names: list[str], args) -> dict:
+    import metrics
+    from LoopWatchdog import LoopWatchdog
+
+    # every benchmark but the micro-benchmarks reports how much it lagged the event loop
+    args.watchdog = LoopWatchdog()
+    results = {}
+    for name in names:
+        logger.info(f"Running benchmark {name}")
+        if BENCHMARKS[name].micro:
+            results[name] = await BENCHMARKS[name](args)
+            continue
+        metrics.reset("loop.lag_ms", "loop.blocked")
+        args.watchdog.start()
+        result = await BENCHMARKS[name](args)
+        await args.watchdog.stop()
+        snapshot = metrics.snapshot()
+        lag = snapshot["observations"].get("loop.lag_ms")
+        result["loop_lag_max_ms"] = round(lag["max"], 3) if lag else 0.0
+        result["loop_blocked"] = snapshot["counters"].get("loop.blocked", 0)
+        results[name] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--emails", type=int, default=10_000, help="mailbox size for email benchmarks")
+    parser.add_argument("--cycles", type=int, default=20, help="listener cycles for the task soak benchmark")
+    parser.add_argument("--instances", type=int, default=2000, help="zones added by the sharding benchmark")
+    parser.add_argument("--shards", type=int, nargs="+", default=[2, 4], help="worker counts for the sharding benchmark")
+    parser.add_argument("--turns", type=int, default=200, help="interrupted turns for the barge-in benchmark")
+    parser.add_argument("--utterances", type=int, default=200, help="utterances for the speech arbitration benchmark")
+    parser.add_argument("--playback-ms", type=float, default=5, help="simulated TTS playback time")
+    parser.add_argument("--frames", type=int, default=5_000, help="frames dispatched by the watchdog benchmark")
+    parser.add_argument("--loopback-frames", type=int, default=1_000_000,
+                        help="frames sent each way by the loopback benchmark")
+    parser.add_argument("--number", type=int, default=10_000, help="calls per repeat of the micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats of the micro-benchmarks, the best is kept")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 100_000],
+                        help="mailbox sizes for the email manager benchmark")
+    parser.add_argument("--snapshot-sizes", type=int, nargs="+", default=[10, 1_000, 10_000],
+                        help="mailbox and per-zone dialog context sizes for the warm restart benchmark")
+    parser.add_argument("--ecus", type=int, default=8, help="ECU connections opened by the multi-ECU benchmark")
+    parser.add_argument("--ecu-emails", type=int, default=1000, help="mailbox size of every ECU in the multi-ECU benchmark")
+    parser.add_argument("--startup-runs", type=int, default=5, help="agent processes started by the startup benchmark")
+    parser.add_argument("--output", help="also write the results to this JSON file, e.g. to save a baseline")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="regression threshold of the micro-benchmarks in percent")
+    parser.add_argument("--macro-threshold", type=float, default=50.0,
+                        help="regression threshold of the other benchmarks in percent, tail latencies are not compared")
+    parser.add_argument("--log-level", default="WARNING", help="agent log level while benchmarking")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    results = asyncio.run(run(args.names or list(BENCHMARKS), args))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.macro_threshold)
+        # reported on stderr regardless of the agent log level, stdout stays pure JSON
+        for regression in regressions:
+            print(f"Regression in {regression['metric']}: {regression['baseline']} -> {regression['value']} "
+                  f"({regression['change_pct']:+.1f}%)", file=sys.stderr)
+        if regressions:
+            failed = True
+        else:
+            print(f"No regression over {args.threshold}% (micro) / {args.macro_threshold}% (macro) "
+                  f"against {args.baseline}", file=sys.stderr)
+    # benchmarks that double as soak checks report "passed"
+    if failed or any(result.get("passed") is False for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,35 @@ import os
 
 MAX_RETRY_LIMIT = 100
 
+MAX_TASKS_PER_INSTANCE = 8
+
+# number of worker processes running the Model instances, 0 runs everything in the Device process
+SHARDS = int(os.getenv("AGENT_SHARDS", "0"))
+
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+CACHE_DIR = os.getenv("AGENT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# ECU websocket endpoint
+ECU_HOST = os.getenv("AGENT_ECU_HOST", "localhost")
+ECU_PORT = int(os.getenv("AGENT_ECU_PORT", "9001"))
+
+# ECU endpoints served by one agent process as "host:port", comma separated, e.g. "localhost:9001,localhost:9002"
+ECUS = [endpoint.strip() for endpoint in os.getenv("AGENT_ECUS", f"{ECU_HOST}:{ECU_PORT}").split(",") if endpoint.strip()]
+
+# run the agent on uvloop when it is installed
+UVLOOP = os.getenv("AGENT_UVLOOP", "1") != "0"
+
+EMAIL_STORE_PATH = os.path.join(CACHE_DIR, "emails.sqlite3")
+# batched mailbox frames: parsed off the event loop from this size, ingested and classified by chunks yielding to
+# the loop in between
+LARGE_FRAME_BYTES = 256 * 1024
+EMAIL_INGEST_CHUNK = 500
+
+# warm-restart snapshot of the runtime state, written every SNAPSHOT_INTERVAL seconds, "" disables it
+SNAPSHOT_PATH = os.getenv("AGENT_SNAPSHOT", os.path.join(CACHE_DIR, "state.sqlite3")) or None
+SNAPSHOT_INTERVAL = 1.0
+
 STATES = [
     "idle",
     "listening",
@@ -21,6 +48,37 @@ MOODS = [
     "sad"
 ]
 
+CONTENT_PACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content.json")
+CONTENT_CACHE_MAX_ENTRIES = 64
+CONTENT_CACHE_MAX_BYTES = 1024 * 1024
+CONTENT_CACHE_TTL = 3600  # seconds
+
+RESPONSE_CACHE = os.getenv("AGENT_RESPONSE_CACHE", "1") != "0"  # bypass flag of the response cache
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_MAX_ENTRY_BYTES = 2048
+RESPONSE_CACHE_TTL = 24 * 3600  # seconds
+RESPONSE_CACHE_SIMILARITY = None  # cosine threshold of the similarity tier, e.g. 0.85, None disables it
+
+# trace file of the turn tracing, Chrome trace format or JSON lines if it ends with .jsonl, None disables tracing
+TRACE_PATH = os.getenv("AGENT_TRACE")
+
+# event loop watchdog: lag sampling period and the stall after which the blocking stack is captured
+LOOP_LAG_INTERVAL = 0.1  # seconds
+LOOP_LAG_THRESHOLD = 0.1  # seconds
+
+# upper bound of a TTS playback when the ECU never reports TTS_COMPLETED
+TTS_PLAYBACK_BASE = 5.0  # seconds
+TTS_PLAYBACK_PER_CHAR = 0.1  # seconds
+
+# vocabulary of user interests, the position of an interest is its bit in User.interests
+INTERESTS = [
+    "art_and_culture",
+    "geography",
+    "history",
+    "health_and_sports",
+    "fashion",
+]
+
 LOG_LEVELS = [
     "info",
     "debug",
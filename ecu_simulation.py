@@ -1,12 +1,16 @@
 #!/usr/bin/python3
 
 
+import argparse
 import json
 import asyncio
+import sys
+import time
 import websockets
 from loguru import logger
 
 connected_clients = set()
+message_hooks = []  # callables invoked with every message received from the agent
 
 async def broadcast(data):
     if connected_clients:  # Check if there are any connected websockets
@@ -142,6 +146,8 @@ async def handler(websocket):
     try:
         async for message in websocket:
             logger.info(message)
+            for hook in message_hooks:
+                hook(message)
             if not prepared:
                 await prepare()
                 prepared = True
@@ -181,14 +187,26 @@ async def do_add_email(data=None):
         data = {"fields":[{"name":"predefined","value":"true"},{"name":"receiver_name","value":"Renault User"},{"name":"receiver_email_address","value":"user@renault.com"},{"name":"sender_name","value":"Customer 1"},{"name":"sender_email_address","value":"customer_1@anywhere.com"},{"name":"date","value":"02-04-2024"},{"name":"time","value":"12:50"},{"name":"kind","value":"normal"},{"name":"unread","value":"true"},{"name":"object","value":"Invitation"},{"name":"content","value":"The CEO, Avi, invites all employees to a company event on 23.3.24 at 18:00 at the headquarters. The event will feature food, drinks, and games, offering an opportunity for employees to socialize and have fun."}],"instance":-1,"name":"service_add_email","type":"method_struct"}
     await broadcast(json.dumps(data))
 
-async def do_mailing():
+async def do_add_emails(emails):
+    data = {
+        "name": "service_add_emails",
+        "type": "method_struct_array",
+        "instance": -1,
+        "emails": [email["fields"] for email in emails]
+    }
+    await broadcast(json.dumps(data))
+
+async def do_mailing(batch=False):
     await do_mail_start()
     emails = open('emails.txt', 'r') # contains json lines of messages to send
     emails = emails.read().splitlines()
     # await asyncio.sleep(1)
-    for email in emails:
-        await do_add_email(json.loads(email))
-        # await asyncio.sleep(0.5)
+    if batch:
+        await do_add_emails([json.loads(email) for email in emails])
+    else:
+        for email in emails:
+            await do_add_email(json.loads(email))
+            # await asyncio.sleep(0.5)
 
     # await asyncio.sleep(1)
     await do_mail_end()
@@ -210,6 +228,14 @@ async def do_summarize_email():
     }
     await broadcast(json.dumps(data))
 
+async def do_user_speech():
+    data = {
+        "name": "service_user_speech_detected",
+        "type": "method_void",
+        "instance": 1
+    }
+    await broadcast(json.dumps(data))
+
 async def prompt(message):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, input, message)
@@ -225,16 +251,18 @@ async def interactive():
         logger.info("Mail ..................4")
         logger.info("Next email.............5")
         logger.info("Reset  ................7")
+        logger.info("Mail (batched) ........8")
+        logger.info("User speech ...........9")
         ch = await prompt("Enter choice: ")
         match ch:
             case "1":
-                sflag = input("flag [y/n]: ")
+                sflag = await prompt("flag [y/n]: ")
                 flag = sflag == 'y' or sflag == 'Y' 
                 await do_enable_listener(flag)
             case "2":
                 await do_tts_complted()
             case "3":
-                step = input("feature: ")
+                step = await prompt("feature: ")
                 await do_agent_feature(step)
             case "4":
                 await do_mailing()
@@ -244,12 +272,251 @@ async def interactive():
                 await do_summarize_email()
             case "7":
                 await do_reset()
+            case "8":
+                await do_mailing(batch=True)
+            case "9":
+                await do_user_speech()
+
+
+
+class ScenarioFailed(Exception):
+    pass
+
+
+class ScenarioListener:
+    """Speech-to-text stand-in for in-process runs, answering with the transcripts of the "say" steps."""
+
+    transcripts = None  # asyncio.Queue shared by every zone
+
+    def __init__(self):
+        self.stop_event = asyncio.Event()
+
+    async def start(self):
+        get = asyncio.ensure_future(self.transcripts.get())
+        stop = asyncio.ensure_future(self.stop_event.wait())
+        done, pending = await asyncio.wait({get, stop}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        return get.result() if get in done else None
+
+    async def stop(self):
+        self.stop_event.set()
+
+
+class ScenarioRunner:
+    """
+    Plays a declarative scenario against the connected agent.
+
+    A scenario is a JSON object with a list of `steps`, run in order:
+        {"do": "mailing", "args": {"batch": true}}      call the matching do_* helper of this module
+        {"send": {"name": ..., "instance": 1, ...}}     send a raw frame
+        {"sleep_ms": 500}                               wait
+        {"mark": "asked"}                               remember the current time under a name
+        {"say": "urgent emails"}                        answer the agent's next listening turn (in-process only)
+        {"expect": "service_tts_text", "where": {"instance": 1}, "count": 1, "timeout_ms": 5000,
+         "within_ms": 300, "since": "asked", "label": "resume"}
+                                                        wait for agent frames, and assert the latency budget
+                                                        from a mark (default: the last frame sent)
+        {"repeat": 10, "steps": [...]}                  run nested steps several times
+    Any step with "after_ms" is scheduled on a timer instead and the scenario moves on right away.
+
+    The optional `respond` rules answer agent frames automatically, e.g. TTS_COMPLETED after a playback delay:
+        {"on": "service_tts_text", "send": {"name": "service_tts_completed", "type": "method_void"},
+         "delay_ms": 200, "per_char_ms": 1}
+    The reply goes to the instance of the triggering frame unless it sets its own.
+
+    Expectations consume agent frames in order: a frame matched by one expect step can't match a later one. Only
+    frames received from the `since` mark on match, those arriving before the expect step itself started still
+    count, so fast replies are never missed and stale frames never pass for a reply.
+    """
+
+    def __init__(self, scenario: dict):
+        self.scenario = scenario
+        self.name = scenario.get("name", "scenario")
+        self.received = []  # (arrival time, message) of every agent frame
+        self.cursor = 0  # index of the first frame not consumed by an expect step yet
+        self.consumed = set()  # indexes of the frames matched by an expect step
+        self.arrived = asyncio.Event()
+        self.marks = {"start": time.perf_counter()}  # "sent" is the last frame sent to the agent
+        self.latencies = {}  # label -> worst measured latency in ms, labels repeat in "repeat" steps
+        self.failures = []
+        self.timers = set()
+
+    def on_message(self, raw: str):
+        try:
+            message = json.loads(raw.rstrip("\n\x00"))
+        except ValueError:
+            return
+        self.received.append((time.perf_counter(), message))
+        self.arrived.set()
+        for rule in self.scenario.get("respond", []):
+            if self._matches(message, rule["on"], rule.get("where")):
+                reply = {"instance": message.get("instance"), **rule["send"]}
+                delay = rule.get("delay_ms", 0) + rule.get("per_char_ms", 0) * len(self._tts_text(message))
+                self._schedule(delay, lambda reply=reply: self._send(reply))
+
+    @staticmethod
+    def _tts_text(message: dict) -> str:
+        for field in message.get("fields") or ():
+            if field.get("name") == "text":
+                return field.get("value") or ""
+        return ""
+
+    @staticmethod
+    def _matches(message: dict, name: str, where: dict | None) -> bool:
+        if message.get("name") != name:
+            return False
+        for key, value in (where or {}).items():
+            if key == "fields":  # {"field name": value} against the [{"name": ..., "value": ...}] list
+                fields = {field.get("name"): field.get("value") for field in message.get("fields") or ()}
+                if any(fields.get(k) != v for k, v in value.items()):
+                    return False
+            elif message.get(key) != value:
+                return False
+        return True
+
+    def _schedule(self, delay_ms: float, make_coro):
+        async def delayed():
+            await asyncio.sleep(delay_ms / 1000)
+            await make_coro()
+        task = asyncio.create_task(delayed())
+        self.timers.add(task)
+        task.add_done_callback(self.timers.discard)
+
+    async def _send(self, frame: dict):
+        self.marks["sent"] = time.perf_counter()
+        await broadcast(json.dumps(frame))
+
+    async def run(self) -> dict:
+        start = self.marks["sent"] = self.marks["start"]
+        try:
+            await self._run_steps(self.scenario.get("steps", []))
+        except ScenarioFailed as e:
+            self.failures.append(str(e))
+        finally:
+            for task in self.timers:
+                task.cancel()
+        return {
+            "scenario": self.name,
+            "passed": not self.failures,
+            "elapsed_s": round(time.perf_counter() - start, 3),
+            "latencies_ms": self.latencies,
+            "failures": self.failures,
+        }
 
+    async def _run_steps(self, steps: list[dict]):
+        for step in steps:
+            if "after_ms" in step:
+                delayed_step = {key: value for key, value in step.items() if key != "after_ms"}
+                self._schedule(step["after_ms"], lambda delayed_step=delayed_step: self._step(delayed_step))
+            else:
+                await self._step(step)
+
+    async def _step(self, step: dict):
+        if "do" in step:
+            self.marks["sent"] = time.perf_counter()
+            await globals()[f"do_{step['do']}"](**step.get("args", {}))
+        elif "send" in step:
+            await self._send(step["send"])
+        elif "sleep_ms" in step:
+            await asyncio.sleep(step["sleep_ms"] / 1000)
+        elif "mark" in step:
+            self.marks[step["mark"]] = time.perf_counter()
+        elif "say" in step:
+            if ScenarioListener.transcripts is None:
+                raise ScenarioFailed("\"say\" steps need the in-process agent (--in-process)")
+            self.marks["sent"] = time.perf_counter()
+            ScenarioListener.transcripts.put_nowait(step["say"])
+        elif "expect" in step:
+            await self._expect(step)
+        elif "repeat" in step:
+            for _ in range(step["repeat"]):
+                await self._run_steps(step["steps"])
+        else:
+            raise ScenarioFailed(f"Unknown step: {step}")
+
+    async def _expect(self, step: dict):
+        name, where = step["expect"], step.get("where")
+        count = step.get("count", 1)
+        since = self.marks[step.get("since", "sent")]
+        label = step.get("label", name)
+        deadline = time.perf_counter() + step.get("timeout_ms", 5000) / 1000
+        matched = 0
+        position = self.cursor
+        while True:
+            # only the matched frames are consumed, the skipped ones stay available to the next expect steps. Frames
+            # older than the `since` mark answer an earlier stimulus and never match
+            while position < len(self.received):
+                arrival, message = self.received[position]
+                if (position not in self.consumed and arrival >= since
+                        and self._matches(message, name, where)):
+                    self.consumed.add(position)
+                    matched += 1
+                position += 1
+                if matched == count:
+                    break
+            if matched == count:
+                break
+            self.arrived.clear()
+            remaining = deadline - time.perf_counter()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                raise ScenarioFailed(f"{label}: got {matched} of {count} {name} frames before the timeout")
+
+        while self.cursor in self.consumed:
+            self.consumed.discard(self.cursor)
+            self.cursor += 1
+        latency_ms = round((arrival - since) * 1000, 3)
+        self.latencies[label] = max(latency_ms, self.latencies.get(label, latency_ms))
+        budget = step.get("within_ms")
+        if latency_ms < 0:
+            self.failures.append(f"{label}: matched a frame received {-latency_ms} ms before its stimulus")
+        elif budget is not None and latency_ms > budget:
+            # a missed budget fails the scenario but doesn't stop it, the other latencies are still measured
+            self.failures.append(f"{label}: {latency_ms} ms over the {budget} ms budget")
+        logger.info(f"{label}: {latency_ms} ms")
+
+
+async def start_in_process_agent():
+    """Runs the agent in this process over the in-memory transport, with scripted speech-to-text."""
+    from Device import Device
+    from Transport import loopback_pair
+    from model import Model
+
+    Model.listener_cls = ScenarioListener
+    ScenarioListener.transcripts = asyncio.Queue()
+    device_end, ecu_end = loopback_pair()
+    device = Device(url="", email_store_path=None)
+    asyncio.create_task(handler(ecu_end))
+    asyncio.create_task(device.serve(device_end))
+    return ecu_end
+
+
+async def run_scenario(path: str, in_process: bool, port: int) -> dict:
+    with open(path) as f:
+        scenario = json.load(f)
+    runner = ScenarioRunner(scenario)
+    message_hooks.append(runner.on_message)
+    if in_process:
+        transport = await start_in_process_agent()
+    else:
+        server = await websockets.serve(handler, "", port)
+        logger.info(f"Waiting for the agent on port {port}")
+    while not connected_clients:
+        await asyncio.sleep(0.05)
+    try:
+        return await runner.run()
+    finally:
+        message_hooks.remove(runner.on_message)
+        if in_process:
+            await transport.close()
+        else:
+            server.close()
 
 
-async def main():
-    PORT = 9001
-    server = await websockets.serve(handler, "", PORT)
+async def main(port: int = 9001):
+    server = await websockets.serve(handler, "", port)
     
     await asyncio.gather(
         server.wait_closed(),  # Wait for the server to be closed.
@@ -259,6 +526,20 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="ECU simulator, interactive unless a scenario is given")
+    parser.add_argument("--scenario", action="append", help="scenario file to play, can be repeated")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run the agent in this process instead of waiting for it to connect")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    if not args.scenario:
+        asyncio.run(main(args.port))
+    else:
+        results = [asyncio.run(run_scenario(path, args.in_process, args.port)) for path in args.scenario]
+        print(json.dumps(results, indent=2))
+        sys.exit(0 if all(result["passed"] for result in results) else 1)
 
 
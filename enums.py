@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class MessageName(str, Enum):
@@ -13,10 +13,12 @@ class MessageName(str, Enum):
     MAIL_START = "service_predefined_mail_transaction_start"
     MAIL_END = "service_predefined_mail_transaction_finished"
     EMAIL_ADD = "service_add_email"
+    EMAILS_ADD = "service_add_emails"
     NEXT_EMAIL = "service_next_email"
     SUMMARIZE_EMAIL = "service_summarize_email"
     AGENT_FEATURE = "service_agent_feature"
     TTS_COMPLETED = "service_tts_completed"
+    USER_SPEECH = "service_user_speech_detected"
     #------- Agent 2 ECU -----------------------------
     DEVICE_READY = "service_device_is_ready"
     DIALOG_STATE = "service_dialog_state"
@@ -37,6 +39,11 @@ class DialogState(str, Enum):
     LISTENING = "listening"
     PROCESS_INTERRUPTED = "process_interrupted"
 
+class SpeechPriority(IntEnum):
+    # lower value is more urgent
+    URGENT_EMAIL = 0
+    DIALOG = 1
+
 class EmailClass(str, Enum):
     URGENT = "CONTAIN"
     NOT_URGENT = "NOT_CONTAIN"
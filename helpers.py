@@ -1,26 +1,23 @@
-import constants as c
 import re
 from enums import EmailClass
-import subprocess
 
+# Define patterns for urgent and non-urgent keywords, compiled once per process
+URGENT_KEYWORDS = ['urgent', 'important', 'crucial', 'critical']
+NEGATIONS = ['not', 'non', 'less']
+
+URGENT_PATTERN = re.compile(r'\b(?:' + '|'.join(URGENT_KEYWORDS) + r')\b')
+# urgent keywords with preceding negation
+NEGATED_URGENT_PATTERN = re.compile(r'\b(?:' + '|'.join(NEGATIONS) + r')\s+(?:' + '|'.join(URGENT_KEYWORDS) + r')\b')
 
 
 def classify_urgency(response):
     # Convert the response to lowercase to handle case variations
     response = response.lower()
-    
-    # Define patterns for urgent and non-urgent keywords
-    urgent_keywords = ['urgent', 'important', 'crucial', 'critical']
-    negations = ['not', 'non', 'less']
-
-    # Check for urgent keywords with preceding negation
-    pattern_urgent = r'\b(?:' + '|'.join(urgent_keywords) + r')\b'
-    pattern_negation = r'\b(?:' + '|'.join(negations) + r')\s+(?:' + '|'.join(urgent_keywords) + r')\b'
 
     # Search for patterns in the response
-    if re.search(pattern_negation, response):
+    if NEGATED_URGENT_PATTERN.search(response):
         return EmailClass.NOT_URGENT
-    elif re.search(pattern_urgent, response):
+    elif URGENT_PATTERN.search(response):
         return EmailClass.URGENT
     else:
         return None
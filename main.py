@@ -1,19 +1,49 @@
-import os
 import asyncio
+import os
 import constants as c
+import tracing
 from Device import Device
+from LoopWatchdog import LoopWatchdog
+from SharedResources import SharedResources
+from loguru import logger
+
 
-ecu_host = "localhost"
-ecu_port = 9001
+def ecu_path(path: str | None, endpoint: str) -> str | None:
+    """Per-ECU variant of a state file, a single ECU keeps the plain name."""
+    if path is None or len(c.ECUS) == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{endpoint.replace(':', '_')}{ext}"
 
 
 async def main():
-    url = f"ws://{ecu_host}:{ecu_port}"
+    tracing.configure(c.TRACE_PATH)
+    LoopWatchdog().start()
+
+    # one Device per ECU, sharing the immutable resources of the process
+    shared = SharedResources()
+    devices = [
+        Device(url=f"ws://{endpoint}", email_store_path=ecu_path(c.EMAIL_STORE_PATH, endpoint), shards=c.SHARDS,
+               snapshot_path=ecu_path(c.SNAPSHOT_PATH, endpoint), shared=shared,
+               name="device" if len(c.ECUS) == 1 else f"device_{endpoint}")
+        for endpoint in c.ECUS
+    ]
+
+    await asyncio.gather(*(device.start() for device in devices))
 
-    device = Device(url=url)
 
-    await device.start()
+def run(coro):
+    """Runs the agent on uvloop when it is installed and enabled, on the default asyncio loop otherwise."""
+    if c.UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            logger.info("Running on uvloop")
+            return uvloop.run(coro)
+    return asyncio.run(coro)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
@@ -0,0 +1,89 @@
+"""
+Process-wide metrics registry.
+
+Counters and gauges are plain numbers, live gauges are callables evaluated on `snapshot()`,
+and observations keep count/sum/max plus a bounded window of recent samples for percentiles.
+"""
+from collections import defaultdict, deque
+
+WINDOW = 1024  # number of recent samples kept per observed metric
+
+_counters = defaultdict(int)
+_gauges = {}
+_live_gauges = {}
+_observations = {}
+
+
+class _Observation:
+    __slots__ = ("count", "total", "max", "window")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window = deque(maxlen=WINDOW)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.window.append(value)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.window)
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": ordered[len(ordered) // 2] if ordered else 0.0,
+            "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0,
+            "max": self.max,
+        }
+
+
+def inc(name: str, value: int = 1):
+    _counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    _gauges[name] = value
+
+
+def register_gauge(name: str, func):
+    """Registers a gauge whose value is read from `func()` at snapshot time."""
+    _live_gauges[name] = func
+
+
+def unregister_gauge(name: str):
+    _live_gauges.pop(name, None)
+
+
+def observe(name: str, value: float):
+    observation = _observations.get(name)
+    if observation is None:
+        observation = _observations[name] = _Observation()
+    observation.add(value)
+
+
+def snapshot() -> dict:
+    gauges = dict(_gauges)
+    for name, func in _live_gauges.items():
+        gauges[name] = func()
+    return {
+        "counters": dict(_counters),
+        "gauges": gauges,
+        "observations": {name: observation.summary() for name, observation in _observations.items()},
+    }
+
+
+def reset(*names: str):
+    """Clears the given metrics, or every metric if no name is given."""
+    if not names:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
+        return
+    for name in names:
+        _counters.pop(name, None)
+        _gauges.pop(name, None)
+        _observations.pop(name, None)
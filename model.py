@@ -1,13 +1,22 @@
 import asyncio
 import re
+import time
 
 
 from loguru import logger
 
+import metrics
+import tracing
 from Listener import Listener
+from TaskSupervisor import TaskSupervisor
 from enums import DialogState, AgentFeature
 import constants as c
 
+# intent matchers, compiled once per process and shared by every model
+NEXT_PATTERN = re.compile(r'\bnext\b', re.IGNORECASE)
+STOP_PATTERN = re.compile(r'\bstop\b', re.IGNORECASE)
+
+
 class NoQueryDetected(Exception):
     pass
 
@@ -17,12 +26,15 @@ class Model:
     Handles speech recognition, dialog state management, text generation, and interaction with external systems.
     """
 
-    def __init__(self, instance_id: str):
+    listener_cls = Listener  # speech-to-text engine, replaceable for headless runs and benchmarks
+
+    def __init__(self, instance_id: str, device_name: str = "device"):
         """
         Initializes the Model instance.
 
         Args:
             instance_id: Unique identifier for the agent instance.
+            device_name: Name of the owning Device, prefixes the task metrics as instance ids repeat across ECUs.
         """
         logger.info(f"Initializing Model for instance_id: {instance_id}")
 
@@ -34,46 +46,65 @@ class Model:
         self.n_sents_chunk = 1
 
         self.chat_task = None
-        self.ongoing_tasks = []
+        self.tasks = TaskSupervisor(f"{device_name}.model_{instance_id}", max_concurrency=c.MAX_TASKS_PER_INSTANCE)
         self.chat_enabled = False
+        self._tts_done = asyncio.Event()  # backs `tts_completed`, lets the chat loop wake on TTS_COMPLETED
         self.tts_completed = True
         self.idle_on_completion = False
 
+        self.armed_listener = None  # listener prepared for the next turn while TTS is still playing
+        self._state_frames = {}  # pre-serialized dialog state frames keyed by state
+
         self.context = []
 
+    @property
+    def tts_completed(self) -> bool:
+        return self._tts_done.is_set()
+
+    @tts_completed.setter
+    def tts_completed(self, value: bool):
+        if value:
+            self._tts_done.set()
+        else:
+            self._tts_done.clear()
+
     async def _init_listener(self) -> bool:
-        """Initializes the speech-to-text engine."""
-        self.listener = Listener()
+        """Initializes the speech-to-text engine, activating the pre-armed listener if there is one."""
+        if self.armed_listener is not None:
+            self.listener, self.armed_listener = self.armed_listener, None
+        else:
+            self.listener = self.listener_cls()
         return True
 
+    def _prearm_listener(self):
+        """Prepares the next listen session while TTS is playing, so it starts the instant playback completes."""
+        if self.armed_listener is None:
+            self.armed_listener = self.listener_cls()
+        self._get_state_frame(DialogState.LISTENING.value)
+
+    def _get_state_frame(self, state: str) -> str:
+        frame = self._state_frames.get(state)
+        if frame is None:
+            frame = self._state_frames[state] = self.device.dialog_state_frame(state, self.instance_id)
+        return frame
+
     async def stop_tasks(self, idle: bool = True):
         """Cancels ongoing tasks and optionally resets the dialog state to idle."""
-        for task in [t for t in self.ongoing_tasks if not t.done()]:
-            await self._safe_cancel_task(task)
+        await self.tasks.cancel(scope="turn")
+        await self.tasks.cancel(scope="generate")
 
         if self.listener:
             await self.listener.stop()
 
-        self.ongoing_tasks = []
-
         if idle:
             self.context = []
             if self.state != DialogState.IDLE:
                 await self._set_state(DialogState.IDLE)
 
-    async def _safe_cancel_task(self, task: asyncio.Task):
-        """Cancels a task with error handling."""
-        try:
-            task.cancel()
-            await task
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            logger.error(f"Error while cancelling task: {e}")
-
     async def set_device(self, device):
         """Associates the model with a device and initializes it."""
         self.device = device
+        self._state_frames = {}
         if not await self._init_listener():
             logger.error("Failed to initialize Listener")
             return
@@ -89,20 +120,19 @@ class Model:
         assert state in c.STATES, f"Invalid state: {state}, must be one of {c.STATES}"
         self.state = state
         if self.device:
-            await self.device.send_dialog_state(state, self.instance_id)
+            await self.device.send_frame(self._get_state_frame(state))
 
     async def _listen(self, timeout: int = None) -> dict:
         """Listens for user speech input."""
         await self._set_state(DialogState.LISTENING)
         try:
-            transcribe_task = asyncio.create_task(self.listener.start())
-            query = await asyncio.wait_for(transcribe_task, timeout=timeout)
+            query = await asyncio.wait_for(self.listener.start(), timeout=timeout)
         except asyncio.TimeoutError:
             logger.warning("Listen operation timed out")
             query = None
         except asyncio.CancelledError:
             logger.info("Listen operation was cancelled")
-            query = None
+            raise
         except Exception as e:
             logger.error(f"Error during listen operation: {e}", exc_info=True)
             query = None
@@ -110,35 +140,68 @@ class Model:
             await self.listener.stop()
         return query
 
-    async def get_response(self):
+    async def barge_in(self) -> bool:
+        """
+        Cuts the agent off when the user starts speaking over it.
+        Cancels the in-flight generation, interrupts TTS playback and goes straight back to listening.
+
+        Returns:
+            True if the agent was interrupted, False if it was not processing or speaking.
+        """
+        speaking = not self.tts_completed
+        if not speaking and self.state not in (DialogState.PROCESSING, DialogState.RESPONDING):
+            return False
+        start = time.perf_counter()
+        # drops the queued speech of this zone and sends TTS_INTERRUPT if it is playing
+        await self.device.speech.cancel(self.instance_id)
+        await self._set_state(DialogState.PROCESS_INTERRUPTED)
+        await self.tasks.cancel(scope="generate")
+        self.tts_completed = True  # playback was cut, the chat loop must not wait for TTS_COMPLETED
+        await self._set_state(DialogState.LISTENING)
+        metrics.observe("barge_in.latency_ms", (time.perf_counter() - start) * 1000)
+        logger.info(f"User barged in on instance {self.instance_id}")
+        return True
+
+    async def get_response(self, query: str = None):
         """Generates a response from the language model."""
-        await self._set_state(DialogState.RESPONDING)
-        response = "This is a placeholder response."
-        await self.device.send_text(response, self.instance_id)
+        with tracing.span("generate", self.instance_id):
+            await self._set_state(DialogState.RESPONDING)
+            response = "This is a placeholder response."
+            await self.device.send_text(response, self.instance_id)
         return response
 
     async def process_work_query(self, query: dict):
-        if isinstance(query, dict):
-            transcript = query.get('transcript', '')  # Extract transcript, default to '' if not found
-        else:
-            transcript = query
+        # keep listening until the user says next or stop, the chat is disabled or nothing is heard
+        while self.chat_enabled:
+            if isinstance(query, dict):
+                transcript = query.get('transcript', '')  # Extract transcript, default to '' if not found
+            else:
+                transcript = query
 
-        if not transcript:
-            transcript = ''
+            if not transcript:
+                transcript = ''
 
-        if re.search(r'\bnext\b', transcript, re.IGNORECASE):
-            logger.warning("User said next")
-            self.device.em.next_email = True
-        elif re.search(r'\bstop\b', transcript, re.IGNORECASE):
-            logger.warning("User said stop")
-            await self.device.send_agent_feature(AgentFeature.DIALOG, self.instance_id)
-            await self.disable_chat()
-        else:
-            return await self.process_work_query(await self._listen(300))
+            if NEXT_PATTERN.search(transcript):
+                logger.warning("User said next")
+                self.device.em.next_email = True
+                return
+            elif STOP_PATTERN.search(transcript):
+                logger.warning("User said stop")
+                await self.device.send_agent_feature(AgentFeature.DIALOG, self.instance_id)
+                await self.disable_chat()
+                return
+            query = await self._listen(300)
+            if query is None:
+                return
 
     async def chat_iteration(self) -> None:
+        """Performs a single iteration of the chat loop as a new traced turn."""
+        tracing.start_turn(self.instance_id, self.device.name)
+        with tracing.span("turn", self.instance_id):
+            await self._chat_iteration()
+
+    async def _chat_iteration(self) -> None:
         logger.info("Performing chat iteration")
-        """Performs a single iteration of the chat loop."""
         if not await self._init_listener():
             logger.warning("Failed to initialize new Listener instance")
 
@@ -149,17 +212,16 @@ class Model:
             ai_msg = await self.device.exec_work_flow(self.instance_id, step=self.device.em.step)
             self.context.append(ai_msg)
             if self.device.em.step == 0:  # Last step executed
-                while not self.tts_completed:
-                    await asyncio.sleep(0.2)
-                    logger.debug("Waiting for TTS to complete")
+                logger.debug("Waiting for TTS to complete")
+                await self._tts_done.wait()
                 await self.device.send_agent_feature(AgentFeature.DIALOG, self.instance_id)
                 await self.disable_chat()
                 return
 
-        listen_task = asyncio.create_task(self._listen())
-        self.ongoing_tasks.append(listen_task)
+        listen_task = self.tasks.spawn(self._listen(), "listen", scope="turn")
 
-        listen_result = await listen_task
+        with tracing.span("listen", self.instance_id):
+            listen_result = await listen_task
         if not listen_result:
             raise asyncio.CancelledError("No query")
 
@@ -167,18 +229,21 @@ class Model:
         logger.info(f'User said: {query}')
 
         # Process query based on current agent feature
-        await self._process_query_by_feature(query)
+        with tracing.span("intent", self.instance_id, feature=self.device.agent_feature):
+            await self._process_query_by_feature(query)
 
     async def _process_query_by_feature(self, query: str):
         """Processes the user query based on the active agent feature."""
         if self.device.agent_feature == AgentFeature.WORK:
             await self._handle_work_feature(query)
+        elif self.device.agent_feature in (AgentFeature.EXPLORATION, AgentFeature.GAME):
+            await self._handle_content_feature(query)
         else:
-            await self._handle_dialog()
+            await self._handle_dialog(query)
 
     async def _handle_work_feature(self, query: str):
         """Handles user interactions within the 'work' agent feature."""
-        if re.search(r'\bstop\b', query, re.IGNORECASE):
+        if STOP_PATTERN.search(query):
             logger.warning("User said stop")
             await self.device.send_agent_feature(AgentFeature.DIALOG, self.instance_id)
             await self.disable_chat()
@@ -191,14 +256,45 @@ class Model:
         elif self.device.em.step == 2:
             await self.process_work_query(query) 
 
-    async def _handle_dialog(self):
-        """Handles user interactions in dialog or exploration modes."""
-        gen_task = asyncio.create_task(self.get_response())
-        self.ongoing_tasks.append(gen_task) 
-        response = await gen_task
+    async def _handle_content_feature(self, query: str):
+        """Answers in exploration and avatar modes from the prefetched content, falls back to the dialog."""
+        item = self.device.content.next_item(self.instance_id, self.device.agent_feature)
+        if item is None:
+            await self._handle_dialog(query)
+            return
+        await self._set_state(DialogState.RESPONDING)
+        await self.device.send_text(item["text"], self.instance_id)
+        self.context.append(item["text"])
+
+    async def _handle_dialog(self, query: str):
+        """Handles user interactions in dialog mode, and in exploration and avatar modes when no content is left."""
+        user = self.device.users.get(self.instance_id)
+        feature = self.device.agent_feature
+        cached = self.device.responses.get(query, user, feature)
+        if cached is not None:
+            # cache hit: skip generation entirely
+            await self._set_state(DialogState.RESPONDING)
+            await self.device.send_text(cached, self.instance_id)
+            self.context.append(cached)
+            return
+
+        gen_task = self.tasks.spawn(self.get_response(query), "generate", scope="generate")
+        try:
+            response = await gen_task
+        except asyncio.CancelledError:
+            # a barge-in cancels the generation only, the chat loop goes on listening
+            if not gen_task.cancelled() or asyncio.current_task().cancelling():
+                raise
+            logger.info("Response generation interrupted")
+            return
+        self.device.responses.put(query, user, feature, response)
         self.context.append(response)
 
 
+    def start_chat(self, instant: bool = True) -> asyncio.Task:
+        """Starts the chat loop as a supervised task."""
+        return self.tasks.spawn(self.chat(instant=instant), "chat", scope="chat")
+
     async def chat(self, instant: bool = True):
         """Initiates and manages the main chat loop."""
         self.chat_enabled = True
@@ -218,6 +314,8 @@ class Model:
                 try:
                     await self.chat_iteration()
                 except asyncio.CancelledError as e:
+                    if asyncio.current_task().cancelling():
+                        raise  # the chat loop itself is cancelled by `disable_chat`, which does the cleanup
                     logger.warning(f"Chat cancelled: {e}")
                     idle = False if self.device.em.step == 2 else True
                     await self.disable_chat(idle=idle)
@@ -227,12 +325,14 @@ class Model:
                     await self.disable_chat()
                     break
             else:
-                await asyncio.sleep(0.2)
+                self._prearm_listener()
+                await self._tts_done.wait()
 
     async def disable_chat(self, idle: bool = True):
         """Disables the chat loop and performs cleanup."""
         self.chat_enabled = False
         self.tts_completed = True
         self.idle_on_completion = False
+        await self.tasks.cancel(scope="chat")  # ends the chat loop, unless it is the caller
         await self.stop_tasks(idle=idle)
         await asyncio.sleep(0.1)
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Lightweight turn tracing.
+
+Every user turn gets an id, carried by a context variable into the tasks and frames of that turn. Spans are
+buffered and appended to a trace file: Chrome trace format by default (open it in chrome://tracing or
+ui.perfetto.dev), one JSON object per line if the path ends with `.jsonl`. Tracing is disabled, and costs a
+single check per span, until `configure()` is called.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+FLUSH_EVERY = 256  # buffered events per file write
+
+_turn = contextvars.ContextVar("turn", default=None)
+_turn_ids = itertools.count(1)
+_tracer = None
+
+
+class Tracer:
+    def __init__(self, path: str):
+        self.path = path
+        self.jsonl = path.endswith(".jsonl")
+        self.events = []
+        self.last_turn = {}  # (device name, instance_id) -> id of its latest turn
+        self.pid = os.getpid()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not self.jsonl:
+            # JSON array format, Chrome accepts the array without its closing bracket
+            with open(path, "w") as f:
+                f.write("[\n")
+
+    def record(self, event: dict):
+        self.events.append(event)
+        if len(self.events) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if not self.events:
+            return
+        if self.jsonl:
+            data = "".join(json.dumps(event) + "\n" for event in self.events)
+        else:
+            data = "".join(json.dumps(event) + ",\n" for event in self.events)
+        self.events = []
+        with open(self.path, "a") as f:
+            f.write(data)
+
+
+def configure(path: str | None):
+    """Enables tracing to `path`, None disables it."""
+    global _tracer
+    if _tracer:
+        _tracer.flush()
+    _tracer = Tracer(path) if path else None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def flush():
+    if _tracer:
+        _tracer.flush()
+
+
+atexit.register(flush)
+
+
+def start_turn(instance_id, device: str = "device") -> str | None:
+    """Starts a new turn of an instance of `device` in the current context, returns its id (None if tracing is off)."""
+    if _tracer is None:
+        return None
+    turn_id = f"{instance_id}-{next(_turn_ids)}"
+    _turn.set(turn_id)
+    _tracer.last_turn[device, instance_id] = turn_id
+    return turn_id
+
+
+def current_turn() -> str | None:
+    return _turn.get()
+
+
+def last_turn(instance_id, device: str = "device") -> str | None:
+    """Id of the latest turn of an instance of `device`, for events arriving outside of the turn context."""
+    return _tracer.last_turn.get((device, instance_id)) if _tracer else None
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1000
+
+
+@contextmanager
+def span(name: str, instance_id=None, **attrs):
+    """Records the duration of the enclosed block in the current turn."""
+    if _tracer is None:
+        yield
+        return
+    start = _now_us()
+    try:
+        yield
+    finally:
+        _tracer.record({
+            "name": name, "ph": "X", "ts": start, "dur": _now_us() - start,
+            "pid": _tracer.pid, "tid": instance_id if instance_id is not None else 0,
+            "args": {"turn": _turn.get(), **attrs},
+        })
+
+
+def event(name: str, instance_id=None, turn: str | None = None, **attrs):
+    """Records an instant event, e.g. a frame received from the ECU."""
+    if _tracer is None:
+        return
+    _tracer.record({
+        "name": name, "ph": "i", "s": "t", "ts": _now_us(),
+        "pid": _tracer.pid, "tid": instance_id if instance_id is not None else 0,
+        "args": {"turn": turn or _turn.get(), **attrs},
+    })
+
+
+def tag_frame(frame: str) -> str:
+    """Adds the current turn id to a serialized frame as the optional `turn` field."""
+    turn_id = _turn.get()
+    if turn_id is None:
+        return frame
+    # serialized frames end with "}\0"
+    return f'{frame[:-2]}, "turn": "{turn_id}"}}\0'